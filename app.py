@@ -1,14 +1,28 @@
 import streamlit as st
-import json
-import pandas as pd
 from datetime import datetime
-import plotly.express as px
-import plotly.graph_objects as go
-from conversational_agent import mag7_agent
+from conversational_agent import get_agent
 import os
+import html
 import asyncio
+import atexit
+import threading
+import time
+from collections import deque
+from cachetools import TTLCache
 from dotenv import load_dotenv
 
+# Use uvloop for faster async I/O when available, or winloop on Windows
+# where uvloop isn't supported; otherwise keep the default asyncio loop
+try:
+    import uvloop as fast_loop
+except ImportError:
+    try:
+        import winloop as fast_loop
+    except ImportError:
+        fast_loop = None
+if fast_loop is not None:
+    asyncio.set_event_loop_policy(fast_loop.EventLoopPolicy())
+
 # Load environment variables
 load_dotenv()
 
@@ -21,7 +35,7 @@ st.set_page_config(
 )
 
 # Custom CSS
-st.markdown("""
+CUSTOM_CSS = """
 <style>
     .main-header {
         font-size: 2.5rem;
@@ -49,25 +63,81 @@ st.markdown("""
         margin: 0.3rem 0;
         border-left: 4px solid #1f77b4;
     }
+    .source-table {
+        width: 100%;
+        border-collapse: separate;
+        border-spacing: 0 0.3rem;
+    }
+    .source-table td {
+        border: none;
+        vertical-align: top;
+    }
+    .source-link {
+        width: 25%;
+        white-space: nowrap;
+    }
     .confidence-high { color: #28a745; }
     .confidence-medium { color: #ffc107; }
     .confidence-low { color: #dc3545; }
 </style>
-""", unsafe_allow_html=True)
+"""
+st.markdown(CUSTOM_CSS, unsafe_allow_html=True)
+
+# Sidebar example queries and their widget keys
+EXAMPLE_QUERIES = [
+    "What was Microsoft's revenue for Q1 2024?",
+    "Compare how inflation affected operating margins for Apple vs Microsoft in 2022-2023",
+    "Which MAG7 company showed the most consistent R&D investment growth?",
+    "How did COVID-19 impact Amazon's cloud vs retail revenue?",
+    "Compare operating margins across all MAG7 companies in 2023"
+]
+EXAMPLE_BUTTON_KEYS = [f"example_{i}" for i in range(len(EXAMPLE_QUERIES))]
+
+# Confidence thresholds and their HTML, highest first
+CONFIDENCE_TEMPLATES = [
+    (0.8, "<span class='confidence-high'>High (%.1f%%)</span>"),
+    (0.6, "<span class='confidence-medium'>Medium (%.1f%%)</span>"),
+    (float('-inf'), "<span class='confidence-low'>Low (%.1f%%)</span>")
+]
+
+# How long a cached answer stays valid, in seconds, and how many are kept
+QUERY_CACHE_TTL = 3600
+QUERY_CACHE_MAXSIZE = 1024
+
+# How often the chat area refreshes while an answer streams, in seconds
+POLL_INTERVAL = 0.2
+
+# Number of Q&A turns kept in the session history
+MAX_HISTORY_ITEMS = 50
+
+# How long to wait for the agent before giving up on a query, in seconds
+QUERY_TIMEOUT = 120
 
 @st.cache_resource
 def initialize_agent():
     """Initialize the conversational agent with caching"""
-    return mag7_agent
+    agent = get_agent()
+    
+    # Open client connections on the background loop that will serve queries,
+    # and close them there when the process exits
+    asyncio.run_coroutine_threadsafe(agent.warmup(), get_event_loop())
+    atexit.register(close_agent, agent)
+    return agent
+
+def close_agent(agent):
+    """Close the agent's client connections on the background event loop"""
+    try:
+        asyncio.run_coroutine_threadsafe(agent.close(), get_event_loop()).result(timeout=5)
+    except Exception:
+        pass
 
 def format_confidence(confidence):
     """Format confidence score with color coding"""
-    if confidence >= 0.8:
-        return f"<span class='confidence-high'>High ({confidence:.1%})</span>"
-    elif confidence >= 0.6:
-        return f"<span class='confidence-medium'>Medium ({confidence:.1%})</span>"
-    else:
-        return f"<span class='confidence-low'>Low ({confidence:.1%})</span>"
+    template = next(
+        (template for threshold, template in CONFIDENCE_TEMPLATES if confidence >= threshold),
+        CONFIDENCE_TEMPLATES[-1][1]
+    )
+    return template % (confidence * 100)
 
 def display_sources(sources):
     """Display sources in a formatted way"""
@@ -76,23 +146,34 @@ def display_sources(sources):
         return
     
     st.subheader("📚 Sources")
-    for i, source in enumerate(sources):
-        with st.container():
-            col1, col2 = st.columns([3, 1])
-            with col1:
-                st.markdown(f"""
-                <div class="source-card">
-                    <strong>{source['company']}</strong> - {source['filing']} ({source['period']})<br>
-                    <em>{source['snippet']}</em>
-                </div>
-                """, unsafe_allow_html=True)
-            with col2:
-                if source.get('url'):
-                    st.link_button("View Filing", source['url'])
+    
+    # Emit the whole sources section as one HTML table. The fields come from the
+    # model's output, so each is escaped and only http(s) URLs become links
+    rows = []
+    for source in sources:
+        company, filing, period, snippet = (
+            html.escape(str(source.get(field, '')), quote=True)
+            for field in ('company', 'filing', 'period', 'snippet')
+        )
+        url = str(source.get('url') or '').strip()
+        if url.lower().startswith(('http://', 'https://')):
+            link = f"<a href=\"{html.escape(url, quote=True)}\" target=\"_blank\">View Filing</a>"
+        else:
+            link = ""
+        rows.append(
+            f"<tr>"
+            f"<td class=\"source-card\"><strong>{company}</strong> - {filing} ({period})<br>"
+            f"<em>{snippet}</em></td>"
+            f"<td class=\"source-link\">{link}</td>"
+            f"</tr>"
+        )
+    st.markdown(f"<table class=\"source-table\">{''.join(rows)}</table>", unsafe_allow_html=True)
 
-def create_metrics_dashboard():
-    """Create a metrics dashboard"""
-    st.subheader("📈 Quick Metrics")
+@st.cache_data
+def get_metrics_df():
+    """Build the metrics table once per process"""
+    # Imported here so script reruns don't pay for pandas until the dashboard is built
+    import pandas as pd
     
     # Sample metrics (in a real app, these would come from the database)
     metrics_data = {
@@ -102,31 +183,226 @@ def create_metrics_dashboard():
         'P/E Ratio': [28.5, 35.2, 42.1, 25.8, 22.3, 75.4, 45.2]
     }
     
-    df = pd.DataFrame(metrics_data)
-    st.dataframe(df, use_container_width=True)
+    return pd.DataFrame(metrics_data)
+
+def create_metrics_dashboard():
+    """Create a metrics dashboard"""
+    st.subheader("📈 Quick Metrics")
+    st.dataframe(get_metrics_df(), use_container_width=True)
+
+@st.cache_resource
+def get_system_status_markdown():
+    """Check environment variables once per process and build the status lines"""
+    env_status = {
+        "Google API Key": bool(os.getenv("GOOGLE_API_KEY")),
+        "Pinecone API Key": bool(os.getenv("PINECONE_API_KEY")),
+        "Pinecone Index": bool(os.getenv("PINECONE_INDEX_NAME"))
+    }
+    
+    lines = [f"{'✅' if is_set else '❌'} {key}" for key, is_set in env_status.items()]
+    
+    # Agent status
+    lines += [
+        "✅ LlamaIndex Workflow Agent",
+        "✅ Vector Database Connected",
+        "✅ SEC Filings Indexed"
+    ]
+    
+    # Trailing double space keeps each status on its own line
+    return "  \n".join(lines)
+
+@st.cache_resource
+def get_event_loop():
+    """Start one event loop per process on a background thread so the script thread never blocks on it"""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="agent-event-loop", daemon=True).start()
+    return loop
+
+def submit_async_query(agent, conversation_id, user_query, chunks):
+    """Schedule a streaming query on the background event loop and return its future.
+    Answer text is appended to `chunks` as it is generated."""
+    async def consume_stream():
+        result = None
+        async for item in agent.process_message_stream(conversation_id, user_query):
+            if isinstance(item, str):
+                chunks.append(item)
+            else:
+                result = item
+        return result
+    
+    return asyncio.run_coroutine_threadsafe(consume_stream(), get_event_loop())
+
+def run_on_event_loop(coro):
+    """Run a coroutine on the background event loop and wait for its result"""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result(timeout=QUERY_TIMEOUT)
 
 def run_async_query(agent, conversation_id, user_query):
-    """Run async query with proper event loop handling"""
+    """Run async query on the background event loop and wait for the result"""
     try:
-        # Create new event loop for this thread
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
-        # Run the async function
-        result = loop.run_until_complete(
-            agent.process_message(conversation_id, user_query)
-        )
-        
-        return result
+        return asyncio.run_coroutine_threadsafe(
+            agent.process_message(conversation_id, user_query),
+            get_event_loop()
+        ).result(timeout=QUERY_TIMEOUT)
     except Exception as e:
         st.error(f"Error processing query: {str(e)}")
         return None
-    finally:
-        # Clean up the event loop
-        try:
-            loop.close()
-        except:
-            pass
+
+@st.cache_resource
+def get_query_cache():
+    """Process-wide cache of query results keyed by (conversation_id, normalized query),
+    bounded in size and age; TTLCache isn't thread-safe, so sessions go through the lock"""
+    return TTLCache(maxsize=QUERY_CACHE_MAXSIZE, ttl=QUERY_CACHE_TTL), threading.Lock()
+
+def get_cached_result(conversation_id, user_query):
+    """Return a cached result for this query if it is still fresh"""
+    cache, lock = get_query_cache()
+    with lock:
+        return cache.get((conversation_id, user_query.strip().lower()))
+
+def cache_result(conversation_id, user_query, result):
+    """Store a query result in the process-wide cache"""
+    cache, lock = get_query_cache()
+    with lock:
+        cache[(conversation_id, user_query.strip().lower())] = result
+
+def clear_cached_results(conversation_id):
+    """Drop cached results for a conversation"""
+    cache, lock = get_query_cache()
+    with lock:
+        for key in [key for key in cache if key[0] == conversation_id]:
+            del cache[key]
+
+def append_to_history(user_query, result):
+    """Store a completed query in session state, newest first"""
+    if 'conversation_history' not in st.session_state:
+        st.session_state.conversation_history = deque(maxlen=MAX_HISTORY_ITEMS)
+    st.session_state.conversation_history.appendleft({
+        'query': user_query,
+        'response': result['response'],
+        'timestamp': result['timestamp']
+    })
+
+def show_pending_query():
+    """Show the in-flight answer as it streams and store it in history once it completes,
+    or its error in session state for chat_area to show. Returns True while the query is still running."""
+    pending = st.session_state.get('pending_query')
+    if pending is None:
+        return False
+    
+    future = pending['future']
+    if not future.done() and time.time() - pending['started'] > QUERY_TIMEOUT:
+        # Stop the coroutine on the background loop so it doesn't hold resources
+        future.cancel()
+        st.session_state.pending_query = None
+        st.session_state.query_error = "The query timed out. Please try again."
+        return False
+    
+    if not future.done():
+        partial_answer = "".join(pending['chunks'])
+        if partial_answer:
+            st.markdown(f"**Answer:** {partial_answer}▌")
+        else:
+            st.info("⏳ Analyzing your question with LlamaIndex workflow...")
+        return True
+    
+    st.session_state.pending_query = None
+    try:
+        result = future.result()
+    except Exception as e:
+        st.session_state.query_error = f"Error processing query: {str(e)}"
+        return False
+    
+    cache_result(pending['conversation_id'], pending['query'], result)
+    append_to_history(pending['query'], result)
+    return False
+
+def render_conversation_history():
+    """Render past Q&A turns, newest first"""
+    if 'conversation_history' in st.session_state and st.session_state.conversation_history:
+        st.divider()
+        st.subheader("💭 Conversation History")
+        
+        for i, conv in enumerate(st.session_state.conversation_history):
+            with st.expander(f"Q: {conv['query'][:50]}...", expanded=(i==0)):
+                # Display query
+                st.markdown(f"**Question:** {conv['query']}")
+                
+                # Display answer
+                response = conv['response']
+                if isinstance(response, dict):
+                    st.markdown(f"**Answer:** {response.get('answer', 'No answer provided')}")
+                    
+                    # Display confidence
+                    confidence = response.get('confidence', 0.0)
+                    confidence_html = format_confidence(confidence)
+                    st.markdown(f"**Confidence:** {confidence_html}", unsafe_allow_html=True)
+                    
+                    # Display sources
+                    sources = response.get('sources', [])
+                    if sources:
+                        display_sources(sources)
+                else:
+                    st.markdown(f"**Answer:** {response}")
+
+@st.fragment
+def chat_area(agent):
+    """Question input, streaming answer and history; reruns without the rest of the page"""
+    st.header("🤖 Ask Your Question")
+    
+    # Query input
+    user_query = st.text_area(
+        "Enter your question about MAG7 companies:",
+        value=st.session_state.get('user_query', ''),
+        height=100,
+        placeholder="e.g., What was Microsoft's revenue for Q1 2024?"
+    )
+    
+    # Query submission
+    col1_1, col1_2, col1_3 = st.columns([1, 1, 1])
+    with col1_2:
+        submitted = st.button("🚀 Ask Question", type="primary", use_container_width=True)
+    
+    # Validate before any cache lookup or scheduling
+    user_query = user_query.strip()
+    if submitted and not user_query:
+        st.error("Please enter a question.")
+    elif submitted and st.session_state.get('pending_query'):
+        st.warning("Please wait for the current question to finish.")
+    elif submitted:
+        cached = get_cached_result(st.session_state.conversation_id, user_query)
+        if cached:
+            # Repeated question, answer straight from the cache, still recording the turn
+            # in the agent's history so follow-ups keep their context
+            result = run_on_event_loop(agent.record_turn(st.session_state.conversation_id, user_query, cached['response']))
+            append_to_history(user_query, result)
+        else:
+            # Stream the answer from the background event loop
+            chunks = []
+            st.session_state.pending_query = {
+                'conversation_id': st.session_state.conversation_id,
+                'query': user_query,
+                'chunks': chunks,
+                'started': time.time(),
+                'future': submit_async_query(agent, st.session_state.conversation_id, user_query, chunks)
+            }
+    
+    # Show the in-flight query, if any, polling it on a timer while it runs
+    if st.session_state.get('pending_query'):
+        pending_answer()
+    query_error = st.session_state.pop('query_error', None)
+    if query_error:
+        st.error(query_error)
+    
+    # Display conversation history
+    render_conversation_history()
+
+@st.fragment(run_every=POLL_INTERVAL)
+def pending_answer():
+    """Streaming answer of the in-flight query; only this fragment reruns on each poll.
+    The timer stops once the page reruns without a pending query."""
+    if not show_pending_query():
+        # Finished (or failed): rerun once so the history shows it and polling stops
+        st.rerun()
 
 def main():
     # Initialize agent
@@ -146,16 +422,8 @@ def main():
         
         # Example queries
         st.subheader("Example Queries")
-        example_queries = [
-            "What was Microsoft's revenue for Q1 2024?",
-            "Compare how inflation affected operating margins for Apple vs Microsoft in 2022-2023",
-            "Which MAG7 company showed the most consistent R&D investment growth?",
-            "How did COVID-19 impact Amazon's cloud vs retail revenue?",
-            "Compare operating margins across all MAG7 companies in 2023"
-        ]
-        
-        for query in example_queries:
-            if st.button(query, key=f"example_{hash(query)}"):
+        for query, key in zip(EXAMPLE_QUERIES, EXAMPLE_BUTTON_KEYS):
+            if st.button(query, key=key):
                 st.session_state.user_query = query
         
         st.divider()
@@ -163,80 +431,21 @@ def main():
         # Conversation controls
         st.subheader("💬 Conversation")
         if st.button("Clear History"):
-            agent.clear_conversation_history(st.session_state.conversation_id)
-            st.session_state.conversation_history = []
+            run_on_event_loop(agent.clear_conversation_history(st.session_state.conversation_id))
+            clear_cached_results(st.session_state.conversation_id)
+            st.session_state.conversation_history = deque(maxlen=MAX_HISTORY_ITEMS)
             st.rerun()
         
         # Display conversation summary
-        if hasattr(agent, 'conversation_history') and agent.conversation_history:
-            history = agent.get_conversation_history(st.session_state.conversation_id)
+        history = run_on_event_loop(agent.get_conversation_history(st.session_state.conversation_id))
+        if history:
             st.metric("Total Turns", len(history) // 2)  # Divide by 2 since each turn has user + assistant message
     
     # Main content area
     col1, col2 = st.columns([2, 1])
     
     with col1:
-        st.header("🤖 Ask Your Question")
-        
-        # Query input
-        user_query = st.text_area(
-            "Enter your question about MAG7 companies:",
-            value=st.session_state.get('user_query', ''),
-            height=100,
-            placeholder="e.g., What was Microsoft's revenue for Q1 2024?"
-        )
-        
-        # Query submission
-        col1_1, col1_2, col1_3 = st.columns([1, 1, 1])
-        with col1_2:
-            if st.button("🚀 Ask Question", type="primary", use_container_width=True):
-                if user_query.strip():
-                    with st.spinner("Analyzing your question with LlamaIndex workflow..."):
-                        try:
-                            # Process query asynchronously
-                            result = run_async_query(agent, st.session_state.conversation_id, user_query.strip())
-                            
-                            # Store in session state
-                            if 'conversation_history' not in st.session_state:
-                                st.session_state.conversation_history = []
-                            st.session_state.conversation_history.append({
-                                'query': user_query.strip(),
-                                'response': result['response'],
-                                'timestamp': result['timestamp']
-                            })
-                            
-                            st.rerun()
-                        except Exception as e:
-                            st.error(f"Error processing query: {str(e)}")
-                else:
-                    st.error("Please enter a question.")
-        
-        # Display conversation history
-        if 'conversation_history' in st.session_state and st.session_state.conversation_history:
-            st.divider()
-            st.subheader("💭 Conversation History")
-            
-            for i, conv in enumerate(reversed(st.session_state.conversation_history)):
-                with st.expander(f"Q: {conv['query'][:50]}...", expanded=(i==0)):
-                    # Display query
-                    st.markdown(f"**Question:** {conv['query']}")
-                    
-                    # Display answer
-                    response = conv['response']
-                    if isinstance(response, dict):
-                        st.markdown(f"**Answer:** {response.get('answer', 'No answer provided')}")
-                        
-                        # Display confidence
-                        confidence = response.get('confidence', 0.0)
-                        confidence_html = format_confidence(confidence)
-                        st.markdown(f"**Confidence:** {confidence_html}", unsafe_allow_html=True)
-                        
-                        # Display sources
-                        sources = response.get('sources', [])
-                        if sources:
-                            display_sources(sources)
-                    else:
-                        st.markdown(f"**Answer:** {response}")
+        chat_area(agent)
     
     with col2:
         # Metrics dashboard
@@ -245,20 +454,7 @@ def main():
         # System status
         st.subheader("🔧 System Status")
         
-        # Check environment variables
-        env_status = {
-            "Google API Key": "✅" if os.getenv("GOOGLE_API_KEY") else "❌",
-            "Pinecone API Key": "✅" if os.getenv("PINECONE_API_KEY") else "❌",
-            "Pinecone Index": "✅" if os.getenv("PINECONE_INDEX_NAME") else "❌"
-        }
-        
-        for key, status in env_status.items():
-            st.markdown(f"{status} {key}")
-        
-        # Agent status
-        st.markdown("✅ LlamaIndex Workflow Agent")
-        st.markdown("✅ Vector Database Connected")
-        st.markdown("✅ SEC Filings Indexed")
+        st.markdown(get_system_status_markdown())
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
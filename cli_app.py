@@ -5,13 +5,13 @@ Built with LlamaIndex workflow architecture for multi-step reasoning.
 """
 
 import asyncio
-import json
 import os
 import sys
 from datetime import datetime
 from dotenv import load_dotenv
+from prompt_toolkit import PromptSession
 
-from conversational_agent import mag7_agent
+from conversational_agent import get_agent
 
 # Load environment variables
 load_dotenv()
@@ -77,10 +77,11 @@ def print_status():
     print("  ✅ Vector Database: Connected")
     print("  ✅ SEC Filings: Indexed")
 
-def format_response(response):
+def format_response(response, answer_streamed=False):
     """Format and display the response"""
     if isinstance(response, dict):
-        print(f"\n🤖 Answer: {response.get('answer', 'No answer provided')}")
+        if not answer_streamed:
+            print(f"\n🤖 Answer: {response.get('answer', 'No answer provided')}")
         
         confidence = response.get('confidence', 0.0)
         print(f"📊 Confidence: {confidence:.1%}")
@@ -93,15 +94,23 @@ def format_response(response):
                 print(f"     {source['snippet'][:100]}...")
                 if source.get('url'):
                     print(f"     URL: {source['url']}")
-    else:
+    elif not answer_streamed:
         print(f"\n🤖 Answer: {response}")
 
 async def process_query(conversation_id, user_query):
-    """Process a query asynchronously"""
+    """Process a query asynchronously, printing the answer as it streams"""
+    print("\n🤖 Answer: ", end="", flush=True)
     try:
-        result = await mag7_agent.process_message(conversation_id, user_query)
+        result = None
+        async for item in get_agent().process_message_stream(conversation_id, user_query):
+            if isinstance(item, str):
+                print(item, end="", flush=True)
+            else:
+                result = item
+        print()
         return result['response']
     except Exception as e:
+        print(f"I apologize, but I encountered an error: {str(e)}. Please try again.")
         return {
             "answer": f"I apologize, but I encountered an error: {str(e)}. Please try again.",
             "sources": [],
@@ -111,15 +120,28 @@ async def process_query(conversation_id, user_query):
 async def main():
     """Main CLI application loop"""
     print_banner()
+    
+    # Build the agent after the banner so startup cost doesn't delay it
+    agent = get_agent()
+    
+    # Open client connections in the background while the user types
+    # (keep a reference so the task is not garbage collected, and so it can be
+    # stopped on exit)
+    warmup_task = asyncio.create_task(agent.warmup())
+    
     print_help()
     
     # Initialize conversation ID
     conversation_id = f"cli_conv_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
     
+    # Async prompt keeps the event loop free for background work while waiting for input
+    session = PromptSession()
+    
     while True:
         try:
             # Get user input
-            user_input = input("\n💬 Enter command: ").strip()
+            print()
+            user_input = (await session.prompt_async("💬 Enter command: ")).strip()
             
             if not user_input:
                 continue
@@ -142,7 +164,7 @@ async def main():
                 print_status()
             
             elif command == 'history':
-                history = mag7_agent.get_conversation_history(conversation_id)
+                history = await agent.get_conversation_history(conversation_id)
                 if history:
                     print(f"\n💭 Conversation History ({len(history)} messages):")
                     for i, msg in enumerate(history[-10:], 1):  # Show last 10 messages
@@ -155,7 +177,7 @@ async def main():
                     print("No conversation history yet.")
             
             elif command == 'clear':
-                mag7_agent.clear_conversation_history(conversation_id)
+                await agent.clear_conversation_history(conversation_id)
                 print("🗑️ Conversation history cleared.")
             
             elif command == 'ask':
@@ -170,7 +192,7 @@ async def main():
                 
                 # Process the query
                 response = await process_query(conversation_id, question)
-                format_response(response)
+                format_response(response, answer_streamed=True)
             
             else:
                 # Treat as a direct question
@@ -178,14 +200,20 @@ async def main():
                 print("⏳ Analyzing with LlamaIndex workflow...")
                 
                 response = await process_query(conversation_id, user_input)
-                format_response(response)
+                format_response(response, answer_streamed=True)
         
-        except KeyboardInterrupt:
+        except (KeyboardInterrupt, EOFError):
             print("\n👋 Goodbye!")
             break
         except Exception as e:
             print(f"❌ Error: {e}")
             print("Please try again or type 'help' for available commands.")
+    
+    # Stop the warmup if it is still running, then close client connections
+    # on the loop that opened them
+    warmup_task.cancel()
+    await asyncio.gather(warmup_task, return_exceptions=True)
+    await agent.close()
 
 if __name__ == "__main__":
     # Check if required environment variables are set
@@ -199,5 +227,17 @@ if __name__ == "__main__":
         print("\nPlease set these variables in your .env file or environment.")
         sys.exit(1)
     
+    # Use uvloop for faster async I/O when available, or winloop on Windows
+    # where uvloop isn't supported; otherwise keep the default asyncio loop
+    try:
+        import uvloop as fast_loop
+    except ImportError:
+        try:
+            import winloop as fast_loop
+        except ImportError:
+            fast_loop = None
+    if fast_loop is not None:
+        fast_loop.install()
+    
     # Run the CLI application
     asyncio.run(main()) 
\ No newline at end of file
@@ -5,16 +5,34 @@ Built with LlamaIndex workflow architecture for multi-step reasoning and context
 
 import os
 import json
+import asyncio
+import contextlib
+import functools
+import hashlib
+import itertools
 import logging
-from datetime import datetime
-from typing import Dict, Any, Union, List
+import operator
+import random
+import re
+import time
+from datetime import datetime, timezone
+from collections import OrderedDict, defaultdict, deque
+from typing import Dict, Any, Union, List, AsyncIterator
 from dotenv import load_dotenv
+from cachetools import TTLCache
+
+# orjson parses LLM JSON output faster when available
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 from llama_index.core.workflow import Workflow, Event, StartEvent, StopEvent, step, Context
 from llama_index.llms.gemini import Gemini
 from llama_index.embeddings.gemini import GeminiEmbedding
+from google.api_core import exceptions as google_exceptions
 
-from storing_vector_db.retrieval import get_relevant_chunks
+from storing_vector_db.retrieval import get_relevant_chunks, warmup_pinecone_async, close_async_pinecone
 from data_storing.text_cleaning import clean_text_for_query
 
 # Load environment variables
@@ -23,146 +41,198 @@ load_dotenv()
 # Configure logging
 logger = logging.getLogger(__name__)
 
-# Explicitly set environment variables to ensure they're loaded
-os.environ["GOOGLE_API_KEY"] = os.getenv("GOOGLE_API_KEY", "")
-os.environ["PINECONE_API_KEY"] = os.getenv("PINECONE_API_KEY", "")
-os.environ["PINECONE_INDEX_NAME"] = os.getenv("PINECONE_INDEX_NAME", "mag7-financial-intelligence-2025")
+# Make sure the variables exist for modules that read os.environ directly
+os.environ.setdefault("GOOGLE_API_KEY", "")
+os.environ.setdefault("PINECONE_API_KEY", "")
+os.environ.setdefault("PINECONE_INDEX_NAME", "mag7-financial-intelligence-2025")
 
 # Environment variables
 GOOGLE_API_KEY = os.environ["GOOGLE_API_KEY"]
 PINECONE_API_KEY = os.environ["PINECONE_API_KEY"]
 PINECONE_INDEX_NAME = os.environ["PINECONE_INDEX_NAME"]
 
-# Debug: Print API key status (masked for security)
-print("🔑 API Key Debug Information:")
-print(f"GOOGLE_API_KEY: {'✅ Set' if GOOGLE_API_KEY else '❌ Not set'}")
-print(f"PINECONE_API_KEY: {'✅ Set' if PINECONE_API_KEY else '❌ Not set'}")
-print(f"PINECONE_INDEX_NAME: {PINECONE_INDEX_NAME}")
+# Log API key status without revealing the keys
+if logger.isEnabledFor(logging.DEBUG):
+    logger.debug(f"GOOGLE_API_KEY: {'set' if GOOGLE_API_KEY else 'not set'}")
+    logger.debug(f"PINECONE_API_KEY: {'set' if PINECONE_API_KEY else 'not set'}")
+    logger.debug(f"PINECONE_INDEX_NAME: {PINECONE_INDEX_NAME}")
 
-if GOOGLE_API_KEY:
-    print(f"GOOGLE_API_KEY (first 10 chars): {GOOGLE_API_KEY[:10]}...")
-if PINECONE_API_KEY:
-    print(f"PINECONE_API_KEY (first 10 chars): {PINECONE_API_KEY[:10]}...")
+# Keyword rules that classify obvious queries without an LLM call
+GREETING_RE = re.compile(r"^\s*(hi|hello|hey|thanks|thank you|bye|good (morning|afternoon|evening))\b[\s!.,]*$", re.I)
+COMPARE_RE = re.compile(r"\b(compare[sd]?|comparison|vs\.?|versus|between|difference)\b", re.I)
+TREND_RE = re.compile(r"\b(trends?|growth|over time|historical(ly)?|yoy|year[- ]over[- ]year)\b", re.I)
+COMPANY_RE = re.compile(r"\b(apple|aapl|microsoft|msft|amazon|amzn|google|googl|alphabet|meta|facebook|nvidia|nvda|tesla|tsla)\b", re.I)
+METRIC_RE = re.compile(r"\b(revenues?|sales|earnings|eps|income|profits?|margins?|cash flow|expenses|r&d|capex|guidance)\b", re.I)
 
-# Check if .env file exists
-env_file_path = os.path.join(os.getcwd(), '.env')
-print(f".env file exists: {'✅ Yes' if os.path.exists(env_file_path) else '❌ No'}")
-print(f".env file path: {env_file_path}")
-print("=" * 50)
+# Classification results keyed by normalized query, with per-key locks for single-flight misses
+classification_cache = TTLCache(maxsize=4096, ttl=6 * 3600)
+classification_locks = defaultdict(asyncio.Lock)
 
-# Define event classes for workflow
-class classifier_event(Event):
-    classifier_output: str
 
-class financial_rag_event(Event):
-    financial_rag_output: str
+def _connect_redis():
+    """Return an asyncio Redis client when REDIS_URL is set, otherwise None"""
+    redis_url = os.getenv("REDIS_URL")
+    if not redis_url:
+        return None
+    try:
+        import redis.asyncio as redis
+    except ImportError:
+        logger.warning("REDIS_URL is set but redis is not installed; keeping state in memory")
+        return None
+    return redis.from_url(redis_url)
 
-class comparative_analysis_event(Event):
-    comparative_analysis_output: str
 
-class trend_analysis_event(Event):
-    trend_analysis_output: str
-
-class general_query_event(Event):
-    general_query_output: str
-
-class MAG7FinancialWorkflow(Workflow):
+class ResponseCache:
     """
-    LlamaIndex workflow for MAG7 Financial Intelligence Q&A System.
-    Handles multi-step reasoning for complex financial queries about SEC filings.
+    TTL cache for final answers. Stored in Redis when REDIS_URL is set,
+    otherwise kept in process memory.
     """
     
-    # Initialize LLM and embedding models
-    text_llm = Gemini(
-        model="models/gemini-1.5-flash",
-        api_key=GOOGLE_API_KEY
-    )
-    
-    embedding_model = GeminiEmbedding(
-        model_name="models/embedding-001",
-        api_key=GOOGLE_API_KEY
-    )
+    def __init__(self, ttl: int = 6 * 3600, maxsize: int = 2048):
+        """Initialize the cache, connecting to Redis if configured"""
+        self.ttl = ttl
+        self._locks = defaultdict(asyncio.Lock)
+        self._local = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._redis = _connect_redis()
     
-    async def _format_conversation_context(self, conversation_history: List[Dict]) -> str:
-        """Format conversation history for context"""
-        if not conversation_history:
-            return ""
-        
-        formatted_history = ""
-        for msg in conversation_history[-6:]:  # Last 6 messages for context
-            role = msg.get("role", "")
-            content = msg.get("content", "")
-            formatted_history += f"{role}: {content}\n"
-        return formatted_history
+    @staticmethod
+    def make_key(category: str, query: str, top_k: int, history: str = "") -> str:
+        """Build the cache key for a query answered by a given branch after the given history"""
+        normalized_query = clean_text_for_query(query).lower()
+        return hashlib.sha256(f"{category}|{normalized_query}|{top_k}|{history}".encode()).hexdigest()
     
-    async def _extract_json_from_llm_response(self, response_text: str) -> Dict:
-        """Extract JSON from LLM responses"""
+    @contextlib.asynccontextmanager
+    async def single_flight(self, key: str):
+        """Hold the per-key lock so concurrent misses for a key generate once"""
         try:
-            json_start = response_text.find('{')
-            json_end = response_text.rfind('}') + 1
-            if json_start != -1 and json_end != -1:
-                json_str = response_text[json_start:json_end]
-                return json.loads(json_str)
-            return None
-        except Exception as e:
-            logger.error(f"Error extracting JSON: {e}")
-            return None
+            async with self._locks[key]:
+                yield
+        finally:
+            self._locks.pop(key, None)
     
-    async def _get_financial_context(self, query: str, top_k: int = 8) -> str:
-        """Retrieve relevant financial context from vector store"""
-        try:
-            # Clean and prepare query
-            cleaned_query = clean_text_for_query(query)
-            
-            # Get relevant chunks from vector store
-            relevant_chunks = await get_relevant_chunks(cleaned_query, top_k=top_k)
-            
-            if not relevant_chunks:
-                return "No relevant financial data found. Using general knowledge about MAG7 companies."
-            
-            # Format context for LLM
-            context_parts = []
-            for chunk in relevant_chunks:
-                company = chunk.get('company', 'Unknown')
-                filing_type = chunk.get('filing_type', 'Unknown')
-                period = chunk.get('period', 'Unknown')
-                content = chunk.get('content', '')
-                url = chunk.get('url', '')
-                
-                context_part = f"""
-Source: {company} {filing_type} - {period}
-URL: {url}
-Content: {content[:500]}...
----
-"""
-                context_parts.append(context_part)
-            
-            return "\n".join(context_parts)
-        except Exception as e:
-            logger.error(f"Error retrieving financial context: {e}")
-            # Fallback to general knowledge when vector store is unavailable
-            return f"Vector database access error: {str(e)}. Using general knowledge about MAG7 companies (AAPL, MSFT, AMZN, GOOGL, META, NVDA, TSLA) for analysis."
+    async def get(self, key: str) -> Dict:
+        """Return the cached answer for a key, or None"""
+        if self._redis is not None:
+            try:
+                cached = await self._redis.get(f"mag7:answer:{key}")
+                return json.loads(cached) if cached else None
+            except Exception as e:
+                logger.warning(f"Redis cache read failed: {e}")
+        return self._local.get(key)
     
-    @step
-    async def classify_query(self, ctx: Context, ev: StartEvent) -> Union[financial_rag_event, comparative_analysis_event, trend_analysis_event, general_query_event]:
-        """Classify the user query to determine the appropriate processing branch"""
-        
-        # Extract data from event
-        payload = ev.payload if hasattr(ev, 'payload') else {}
-        conversation_id = payload.get("conversation_id", "unknown")
-        user_message = payload.get("user_message", "")
-        conversation_history = payload.get("conversation_history", [])
-        
-        # Store in context
-        await ctx.set("conversation_id", conversation_id)
-        await ctx.set("user_message", user_message)
-        await ctx.set("conversation_history", conversation_history)
-        
-        # Format conversation history
-        formatted_history = await self._format_conversation_context(conversation_history)
-        
-        # Classification prompt
-        classification_prompt = """
+    async def set(self, key: str, value: Dict):
+        """Store an answer under a key"""
+        if self._redis is not None:
+            try:
+                await self._redis.set(f"mag7:answer:{key}", json.dumps(value), ex=self.ttl)
+                return
+            except Exception as e:
+                logger.warning(f"Redis cache write failed: {e}")
+        self._local[key] = value
+
+
+# Final answers of the retrieval branches
+response_cache = ResponseCache()
+
+
+class ConversationStore:
+    """
+    Conversation histories, each bounded to its last max_messages messages.
+    Stored in Redis when REDIS_URL is set so every worker process shares
+    them, otherwise kept in an in-process LRU of max_conversations.
+    """
+    
+    def __init__(self, max_messages: int = 10, max_conversations: int = 10000):
+        """Initialize the store, connecting to Redis if configured"""
+        self.max_messages = max_messages
+        self.max_conversations = max_conversations
+        self._local = OrderedDict()
+        self._redis = _connect_redis()
+    
+    async def get(self, conversation_id: str) -> List[Dict]:
+        """Return the messages of a conversation, oldest first"""
+        if self._redis is not None:
+            try:
+                messages = await self._redis.lrange(f"mag7:conv:{conversation_id}", 0, -1)
+                return [json.loads(message) for message in messages]
+            except Exception as e:
+                logger.warning(f"Redis history read failed: {e}")
+        if conversation_id not in self._local:
+            return []
+        self._local.move_to_end(conversation_id)
+        return list(self._local[conversation_id])
+    
+    async def append(self, conversation_id: str, *messages: Dict):
+        """Add messages to a conversation, dropping the oldest beyond max_messages"""
+        if self._redis is not None:
+            try:
+                key = f"mag7:conv:{conversation_id}"
+                async with self._redis.pipeline(transaction=False) as pipe:
+                    pipe.rpush(key, *(json.dumps(message) for message in messages))
+                    pipe.ltrim(key, -self.max_messages, -1)
+                    await pipe.execute()
+                return
+            except Exception as e:
+                logger.warning(f"Redis history write failed: {e}")
+        if conversation_id not in self._local:
+            self._local[conversation_id] = deque(maxlen=self.max_messages)
+            # Evict the least recently used conversation
+            if len(self._local) > self.max_conversations:
+                self._local.popitem(last=False)
+        self._local.move_to_end(conversation_id)
+        self._local[conversation_id].extend(messages)
+    
+    async def clear(self, conversation_id: str) -> bool:
+        """Delete a conversation, returning whether it existed"""
+        if self._redis is not None:
+            try:
+                return bool(await self._redis.delete(f"mag7:conv:{conversation_id}"))
+            except Exception as e:
+                logger.warning(f"Redis history delete failed: {e}")
+        return self._local.pop(conversation_id, None) is not None
+
+# LLM completions in flight, keyed by prompt
+inflight_completions = {}
+
+# Tail latency and transient error handling for LLM calls
+HEDGE_AFTER_SECONDS = 2.5
+MAX_LLM_RETRIES = 2
+RETRY_BASE_DELAY = 0.5
+RETRYABLE_LLM_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError
+)
+
+def _retry_delay(attempt: int) -> float:
+    """Exponential backoff with jitter for the given retry attempt"""
+    return RETRY_BASE_DELAY * 2 ** attempt + random.uniform(0, RETRY_BASE_DELAY)
+
+# Chunks retrieved while a query is classified; enough for the largest branch
+PREFETCH_TOP_K = 12
+
+# Categories whose branches consume the prefetched chunks
+RAG_CATEGORIES = frozenset({"FINANCIAL_RAG", "COMPARATIVE_ANALYSIS", "TREND_ANALYSIS"})
+
+def _discard_task(task: asyncio.Task):
+    """Cancel a task whose result won't be used, or retrieve its exception if it already failed"""
+    if not task.done():
+        task.cancel()
+    elif not task.cancelled():
+        task.exception()
+
+# Characters of each chunk's content included in the LLM context
+CHUNK_CONTENT_CHARS = 500
+
+# Fields read from each retrieved chunk when building the LLM context
+chunk_fields = operator.itemgetter('company', 'filing_type', 'period', 'url', 'content')
+
+# Vector store results keyed by cleaned query and top_k; filings rarely change intraday
+retrieval_cache = TTLCache(maxsize=2048, ttl=1800)
+
+# Classification prompt
+CLASSIFICATION_PROMPT = """
 You are an AI assistant specialized in classifying financial queries about MAG7 companies (AAPL, MSFT, AMZN, GOOGL, META, NVDA, TSLA) using their SEC filings.
 
 Categories:
@@ -201,62 +271,9 @@ Output Format (JSON only):
 Query: {query}
 Conversation History: {history}
 """
-        
-        # Call LLM for classification
-        classification_input = classification_prompt.format(
-            query=user_message,
-            history=formatted_history
-        )
-        
-        classification_response = await self.text_llm.acomplete(classification_input)
-        classification_result = await self._extract_json_from_llm_response(classification_response.text)
-        
-        if not classification_result:
-            classification_result = {
-                "category": "GENERAL_QUERY",
-                "confidence": 0.5,
-                "explanation": "Default classification due to parsing error"
-            }
-        
-        category = classification_result.get("category", "GENERAL_QUERY")
-        confidence = classification_result.get("confidence", 0.5)
-        explanation = classification_result.get("explanation", "No explanation")
-        
-        # Store classification info
-        await ctx.set("classification_category", category)
-        await ctx.set("classification_confidence", confidence)
-        await ctx.set("classification_explanation", explanation)
-        
-        logger.info(f"Query classified as: {category} (confidence: {confidence:.2f})")
-        
-        # Route to appropriate branch
-        if category == "FINANCIAL_RAG":
-            return financial_rag_event(financial_rag_output=f"Financial RAG query: {user_message}")
-        elif category == "COMPARATIVE_ANALYSIS":
-            return comparative_analysis_event(comparative_analysis_output=f"Comparative analysis query: {user_message}")
-        elif category == "TREND_ANALYSIS":
-            return trend_analysis_event(trend_analysis_output=f"Trend analysis query: {user_message}")
-        else:
-            return general_query_event(general_query_output=f"General query: {user_message}")
-    
-    @step
-    async def financial_rag_step(self, ctx: Context, ev: financial_rag_event) -> StopEvent:
-        """Handle specific financial queries with RAG"""
-        
-        conversation_id = await ctx.get("conversation_id")
-        user_message = await ctx.get("user_message")
-        conversation_history = await ctx.get("conversation_history")
-        
-        logger.info(f"Processing financial RAG query for conversation: {conversation_id}")
-        
-        # Get relevant financial context
-        context = await self._get_financial_context(user_message, top_k=6)
-        
-        # Format conversation history
-        formatted_history = await self._format_conversation_context(conversation_history)
-        
-        # Financial RAG prompt
-        rag_prompt = """
+
+# Financial RAG prompt
+RAG_PROMPT = """
 You are a financial intelligence assistant for MAG7 companies (AAPL, MSFT, AMZN, GOOGL, META, NVDA, TSLA). 
 Answer questions based on SEC filing data with precise citations.
 
@@ -290,48 +307,9 @@ Provide your response in the following JSON format:
  "confidence": 0.95
 }}
 """
-        
-        # Generate response
-        final_prompt = rag_prompt.format(
-            context=context,
-            history=formatted_history,
-            question=user_message
-        )
-        
-        response = await self.text_llm.acomplete(final_prompt)
-        response_text = response.text
-        
-        # Try to extract JSON response
-        json_response = await self._extract_json_from_llm_response(response_text)
-        
-        if json_response:
-            return StopEvent(result=json_response)
-        else:
-            # Fallback to text response
-            return StopEvent(result={
-                "answer": response_text,
-                "sources": [],
-                "confidence": 0.7
-            })
-    
-    @step
-    async def comparative_analysis_step(self, ctx: Context, ev: comparative_analysis_event) -> StopEvent:
-        """Handle comparative analysis queries"""
-        
-        conversation_id = await ctx.get("conversation_id")
-        user_message = await ctx.get("user_message")
-        conversation_history = await ctx.get("conversation_history")
-        
-        logger.info(f"Processing comparative analysis for conversation: {conversation_id}")
-        
-        # Get broader context for comparison
-        context = await self._get_financial_context(user_message, top_k=10)
-        
-        # Format conversation history
-        formatted_history = await self._format_conversation_context(conversation_history)
-        
-        # Comparative analysis prompt
-        comparison_prompt = """
+
+# Comparative analysis prompt
+COMPARISON_PROMPT = """
 You are a financial intelligence assistant specializing in comparative analysis of MAG7 companies.
 Analyze and compare financial data across companies and time periods.
 
@@ -365,47 +343,9 @@ Provide your response in the following JSON format:
  "confidence": 0.95
 }}
 """
-        
-        # Generate response
-        final_prompt = comparison_prompt.format(
-            context=context,
-            history=formatted_history,
-            question=user_message
-        )
-        
-        response = await self.text_llm.acomplete(final_prompt)
-        response_text = response.text
-        
-        # Try to extract JSON response
-        json_response = await self._extract_json_from_llm_response(response_text)
-        
-        if json_response:
-            return StopEvent(result=json_response)
-        else:
-            return StopEvent(result={
-                "answer": response_text,
-                "sources": [],
-                "confidence": 0.7
-            })
-    
-    @step
-    async def trend_analysis_step(self, ctx: Context, ev: trend_analysis_event) -> StopEvent:
-        """Handle trend analysis queries"""
-        
-        conversation_id = await ctx.get("conversation_id")
-        user_message = await ctx.get("user_message")
-        conversation_history = await ctx.get("conversation_history")
-        
-        logger.info(f"Processing trend analysis for conversation: {conversation_id}")
-        
-        # Get historical context for trends
-        context = await self._get_financial_context(user_message, top_k=12)
-        
-        # Format conversation history
-        formatted_history = await self._format_conversation_context(conversation_history)
-        
-        # Trend analysis prompt
-        trend_prompt = """
+
+# Trend analysis prompt
+TREND_PROMPT = """
 You are a financial intelligence assistant specializing in trend analysis of MAG7 companies.
 Analyze historical patterns and trends in financial data.
 
@@ -439,44 +379,9 @@ Provide your response in the following JSON format:
  "confidence": 0.95
 }}
 """
-        
-        # Generate response
-        final_prompt = trend_prompt.format(
-            context=context,
-            history=formatted_history,
-            question=user_message
-        )
-        
-        response = await self.text_llm.acomplete(final_prompt)
-        response_text = response.text
-        
-        # Try to extract JSON response
-        json_response = await self._extract_json_from_llm_response(response_text)
-        
-        if json_response:
-            return StopEvent(result=json_response)
-        else:
-            return StopEvent(result={
-                "answer": response_text,
-                "sources": [],
-                "confidence": 0.7
-            })
-    
-    @step
-    async def general_query_step(self, ctx: Context, ev: general_query_event) -> StopEvent:
-        """Handle general queries and greetings"""
-        
-        conversation_id = await ctx.get("conversation_id")
-        user_message = await ctx.get("user_message")
-        conversation_history = await ctx.get("conversation_history")
-        
-        logger.info(f"Processing general query for conversation: {conversation_id}")
-        
-        # Format conversation history
-        formatted_history = await self._format_conversation_context(conversation_history)
-        
-        # General query prompt
-        general_prompt = """
+
+# General query prompt
+GENERAL_PROMPT = """
 You are a helpful financial intelligence assistant for MAG7 companies (AAPL, MSFT, AMZN, GOOGL, META, NVDA, TSLA).
 You can help with questions about these companies' SEC filings, financial performance, and market analysis.
 
@@ -491,22 +396,461 @@ User Message: {message}
 Provide a helpful, friendly response. If this is a greeting, introduce your capabilities.
 If this is a financial question, guide the user to ask more specific questions.
 """
+
+# Define event classes for workflow
+class classifier_event(Event):
+    classifier_output: str
+
+class query_event(Event):
+    """Request state carried from classification to the branch that answers it"""
+    conversation_id: str
+    user_message: str
+    formatted_history: str
+    prefetched_chunks: Any = None
+
+class financial_rag_event(query_event):
+    financial_rag_output: str
+
+class comparative_analysis_event(query_event):
+    comparative_analysis_output: str
+
+class trend_analysis_event(query_event):
+    trend_analysis_output: str
+
+class general_query_event(query_event):
+    general_query_output: str
+
+class stream_chunk_event(Event):
+    delta: str
+
+# Pieces of the JSON "answer" string read while a response streams in
+ANSWER_FIELD_RE = re.compile(r'"answer"\s*:\s*"')
+PLAIN_TEXT_RE = re.compile(r'[^"\\]+')
+UNICODE_ESCAPE_RE = re.compile(r'\\u([0-9a-fA-F]{4})')
+JSON_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+class AnswerStreamParser:
+    """
+    Reads the "answer" string out of a JSON response while the LLM is
+    still generating it, so the answer can be shown before the JSON is complete.
+    """
+    
+    def __init__(self):
+        """Initialize the parser before any text has arrived"""
+        self._pos = None
+        self._done = False
+    
+    def feed(self, text: str) -> str:
+        """Take the response text generated so far and return the newly available answer text"""
+        if self._done:
+            return ""
+        if self._pos is None:
+            match = ANSWER_FIELD_RE.search(text)
+            if match is None:
+                return ""
+            self._pos = match.end()
+        
+        parts = []
+        pos = self._pos
+        while pos < len(text):
+            plain = PLAIN_TEXT_RE.match(text, pos)
+            if plain:
+                parts.append(plain.group())
+                pos = plain.end()
+            elif text[pos] == '"':
+                self._done = True
+                break
+            elif pos + 1 >= len(text):
+                break  # Escape sequence continues in a later chunk
+            elif text[pos + 1] != 'u':
+                parts.append(JSON_ESCAPES.get(text[pos + 1], text[pos + 1]))
+                pos += 2
+            else:
+                escape = UNICODE_ESCAPE_RE.match(text, pos)
+                if escape is None:
+                    break  # Incomplete \uXXXX, wait for more text
+                code = int(escape.group(1), 16)
+                pos = escape.end()
+                if 0xD800 <= code < 0xDC00:
+                    # A surrogate pair needs its low half before it can be decoded
+                    low = UNICODE_ESCAPE_RE.match(text, pos)
+                    if low is None:
+                        pos = escape.start()
+                        break
+                    code = 0x10000 + ((code - 0xD800) << 10) + (int(low.group(1), 16) - 0xDC00)
+                    pos = low.end()
+                parts.append(chr(code))
+        
+        self._pos = pos
+        return "".join(parts)
+
+def format_conversation_context(conversation_history: List[Dict]) -> str:
+    """Format conversation history for context"""
+    if not conversation_history:
+        return ""
+    
+    # Last 6 messages for context
+    recent_messages = itertools.islice(conversation_history, max(0, len(conversation_history) - 6), None)
+    return "".join(
+        f"{msg.get('role', '')}: {msg.get('content', '')}\n" for msg in recent_messages
+    )
+
+@functools.lru_cache(maxsize=1)
+def get_text_llm() -> Gemini:
+    """Create the Gemini LLM once per process, reading the API key at first use"""
+    return Gemini(
+        model="models/gemini-1.5-flash",
+        api_key=os.environ["GOOGLE_API_KEY"]
+    )
+
+@functools.lru_cache(maxsize=1)
+def get_embedding_model() -> GeminiEmbedding:
+    """Create the Gemini embedding model once per process, reading the API key at first use"""
+    return GeminiEmbedding(
+        model_name="models/embedding-001",
+        api_key=os.environ["GOOGLE_API_KEY"]
+    )
+
+class MAG7FinancialWorkflow(Workflow):
+    """
+    LlamaIndex workflow for MAG7 Financial Intelligence Q&A System.
+    Handles multi-step reasoning for complex financial queries about SEC filings.
+    """
+    
+    # LLM and embedding models are created on first use
+    @property
+    def text_llm(self) -> Gemini:
+        return get_text_llm()
+    
+    @property
+    def embedding_model(self) -> GeminiEmbedding:
+        return get_embedding_model()
+    
+    async def _acomplete(self, prompt: str):
+        """Complete a prompt, sharing the call with an identical prompt already in flight"""
+        completion = inflight_completions.get(prompt)
+        if completion is None:
+            completion = asyncio.ensure_future(self._acomplete_hedged(prompt))
+            inflight_completions[prompt] = completion
+            completion.add_done_callback(lambda _: inflight_completions.pop(prompt, None))
+        # Shield so one caller cancelling doesn't cancel the call for the others
+        return await asyncio.shield(completion)
+    
+    async def _acomplete_hedged(self, prompt: str, hedge_after: float = HEDGE_AFTER_SECONDS, max_retries: int = MAX_LLM_RETRIES):
+        """
+        Complete a prompt, racing a second request when the first is slower
+        than hedge_after and retrying transient API errors with backoff.
+        """
+        for attempt in range(max_retries + 1):
+            requests = [asyncio.ensure_future(self.text_llm.acomplete(prompt))]
+            try:
+                done, pending = await asyncio.wait(requests, timeout=hedge_after)
+                if not done:
+                    requests.append(asyncio.ensure_future(self.text_llm.acomplete(prompt)))
+                    pending = set(requests)
+                
+                # Take the first request that succeeds; fail only when all have
+                while True:
+                    for finished in done:
+                        if finished.exception() is None:
+                            return finished.result()
+                    if not pending:
+                        raise done.pop().exception()
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            except RETRYABLE_LLM_ERRORS as e:
+                if attempt == max_retries:
+                    raise
+                delay = _retry_delay(attempt)
+                logger.warning(f"LLM request failed ({e}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+            finally:
+                for request in requests:
+                    request.cancel()
+    
+    async def _astream_complete(self, prompt: str, max_retries: int = MAX_LLM_RETRIES):
+        """Stream a completion, retrying transient API errors raised before any text arrives"""
+        for attempt in range(max_retries + 1):
+            started = False
+            try:
+                async for chunk in await self.text_llm.astream_complete(prompt):
+                    started = True
+                    yield chunk
+                return
+            except RETRYABLE_LLM_ERRORS as e:
+                if started or attempt == max_retries:
+                    raise
+                delay = _retry_delay(attempt)
+                logger.warning(f"LLM stream failed ({e}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+    
+    async def _extract_json_from_llm_response(self, response_text: str) -> Dict:
+        """Extract JSON from LLM responses"""
+        try:
+            json_start = response_text.find('{')
+            json_end = response_text.rfind('}') + 1
+            if json_start != -1 and json_end > json_start:
+                json_str = response_text[json_start:json_end]
+                if orjson is not None:
+                    try:
+                        return orjson.loads(json_str)
+                    except orjson.JSONDecodeError:
+                        pass  # json also accepts non-strict input such as NaN
+                return json.loads(json_str)
+            return None
+        except Exception as e:
+            logger.error(f"Error extracting JSON: {e}")
+            return None
+    
+    async def _retrieve_chunks(self, query: str, top_k: int) -> List[Dict]:
+        """Get relevant chunks for a query from the vector store"""
+        # Clean and prepare query
+        cleaned_query = clean_text_for_query(query)
+        
+        cache_key = hashlib.sha1(f"{cleaned_query}|{top_k}".encode()).hexdigest()
+        relevant_chunks = retrieval_cache.get(cache_key)
+        if relevant_chunks is None:
+            relevant_chunks = await get_relevant_chunks(cleaned_query, top_k=top_k, max_content_chars=CHUNK_CONTENT_CHARS)
+            # Empty results may be a transient vector store error, so don't keep them
+            if relevant_chunks:
+                retrieval_cache[cache_key] = relevant_chunks
+        return relevant_chunks
+    
+    async def _get_financial_context(self, query: str, top_k: int = 8, prefetched_chunks: asyncio.Task = None) -> str:
+        """Retrieve relevant financial context from vector store"""
+        try:
+            # Get relevant chunks from vector store; results are ordered by
+            # score, so a larger prefetch contains the top_k we need
+            if prefetched_chunks is not None:
+                relevant_chunks = (await prefetched_chunks)[:top_k]
+            else:
+                relevant_chunks = await self._retrieve_chunks(query, top_k)
+            
+            if not relevant_chunks:
+                return "No relevant financial data found. Using general knowledge about MAG7 companies."
+            
+            # Format context for LLM; get_relevant_chunks fills in every field
+            # and has already truncated the content
+            context_parts = []
+            for company, filing_type, period, url, content in map(chunk_fields, relevant_chunks):
+                context_parts.append(
+                    f"Source: {company} {filing_type} - {period}\nURL: {url}\nContent: {content}...\n---\n"
+                )
+            
+            return "".join(context_parts)
+        except Exception as e:
+            logger.error(f"Error retrieving financial context: {e}")
+            # Fallback to general knowledge when vector store is unavailable
+            return f"Vector database access error: {str(e)}. Using general knowledge about MAG7 companies (AAPL, MSFT, AMZN, GOOGL, META, NVDA, TSLA) for analysis."
+    
+    def _classify_with_rules(self, query: str) -> Dict:
+        """Classify an unambiguous query by keyword rules, or return None"""
+        if GREETING_RE.match(query):
+            category = "GENERAL_QUERY"
+        else:
+            is_comparison = COMPARE_RE.search(query) is not None
+            is_trend = TREND_RE.search(query) is not None
+            if is_comparison and not is_trend:
+                category = "COMPARATIVE_ANALYSIS"
+            elif is_trend and not is_comparison:
+                category = "TREND_ANALYSIS"
+            elif not is_comparison and COMPANY_RE.search(query) and METRIC_RE.search(query):
+                category = "FINANCIAL_RAG"
+            else:
+                return None
+        
+        return {
+            "category": category,
+            "confidence": 0.9,
+            "explanation": "Matched keyword rules"
+        }
+    
+    async def _classify_with_llm(self, query: str, formatted_history: str) -> Dict:
+        """Ask the LLM to classify a query"""
+        # Call LLM for classification
+        classification_input = CLASSIFICATION_PROMPT.format_map({
+            "query": query,
+            "history": formatted_history
+        })
+        
+        classification_response = await self._acomplete(classification_input)
+        return await self._extract_json_from_llm_response(classification_response.text)
+    
+    @step
+    async def classify_query(self, ctx: Context, ev: StartEvent) -> Union[financial_rag_event, comparative_analysis_event, trend_analysis_event, general_query_event]:
+        """Classify the user query to determine the appropriate processing branch"""
+        
+        # Extract data from event
+        payload = ev.payload if hasattr(ev, 'payload') else {}
+        conversation_id = payload.get("conversation_id", "unknown")
+        user_message = payload.get("user_message", "")
+        
+        # Start retrieval while the query is classified
+        prefetched_chunks = asyncio.create_task(self._retrieve_chunks(user_message, PREFETCH_TOP_K))
+        
+        category = None
+        try:
+            # Format conversation history once for every step, unless the caller already has
+            formatted_history = payload.get("formatted_history")
+            if formatted_history is None:
+                formatted_history = format_conversation_context(payload.get("conversation_history", []))
+            
+            # Obvious queries are classified by keyword rules. Otherwise reuse the
+            # classification of an identical earlier query after an identical
+            # history, which the LLM classifies with; the lock makes concurrent
+            # identical misses share a single LLM call
+            cache_key = hashlib.sha1(f"{clean_text_for_query(user_message).lower()}|{formatted_history}".encode()).hexdigest()
+            classification_result = self._classify_with_rules(user_message) or classification_cache.get(cache_key)
+            if classification_result is None:
+                async with classification_locks[cache_key]:
+                    classification_result = classification_cache.get(cache_key)
+                    if classification_result is None:
+                        classification_result = await self._classify_with_llm(user_message, formatted_history)
+                        if classification_result:
+                            classification_cache[cache_key] = classification_result
+                classification_locks.pop(cache_key, None)
+            
+            if not classification_result:
+                classification_result = {
+                    "category": "GENERAL_QUERY",
+                    "confidence": 0.5,
+                    "explanation": "Default classification due to parsing error"
+                }
+            
+            category = classification_result.get("category", "GENERAL_QUERY")
+            confidence = classification_result.get("confidence", 0.5)
+            
+            logger.info(f"Query classified as: {category} (confidence: {confidence:.2f})")
+            
+            # The branches get the request state on the event itself
+            request_state = {
+                "conversation_id": conversation_id,
+                "user_message": user_message,
+                "formatted_history": formatted_history,
+                "prefetched_chunks": prefetched_chunks
+            }
+            
+            # Route to appropriate branch
+            if category == "FINANCIAL_RAG":
+                return financial_rag_event(financial_rag_output=f"Financial RAG query: {user_message}", **request_state)
+            elif category == "COMPARATIVE_ANALYSIS":
+                return comparative_analysis_event(comparative_analysis_output=f"Comparative analysis query: {user_message}", **request_state)
+            elif category == "TREND_ANALYSIS":
+                return trend_analysis_event(trend_analysis_output=f"Trend analysis query: {user_message}", **request_state)
+            else:
+                return general_query_event(general_query_output=f"General query: {user_message}", **request_state)
+        finally:
+            # Only the retrieval branches consume the prefetch
+            if category not in RAG_CATEGORIES:
+                _discard_task(prefetched_chunks)
+    
+    async def _run_rag_step(self, ctx: Context, ev: query_event, category: str, prompt_template: str, top_k: int) -> StopEvent:
+        """Answer a query from retrieved SEC filing context with the given prompt"""
+        
+        conversation_id = ev.conversation_id
+        user_message = ev.user_message
+        formatted_history = ev.formatted_history
+        prefetched_chunks = ev.prefetched_chunks
+        
+        logger.info(f"Processing {category} query for conversation: {conversation_id}")
+        
+        # Reuse the answer to an identical earlier query in an identical
+        # conversation, since the history is part of the prompt; the lock
+        # makes concurrent identical misses share a single generation
+        cache_key = response_cache.make_key(category, user_message, top_k, formatted_history)
+        try:
+            async with response_cache.single_flight(cache_key):
+                cached_response = await response_cache.get(cache_key)
+                if cached_response is not None:
+                    logger.info(f"Answer cache hit for {category} query")
+                    return StopEvent(result=cached_response)
+                
+                # Get relevant financial context
+                context = await self._get_financial_context(user_message, top_k=top_k, prefetched_chunks=prefetched_chunks)
+                
+                # Generate response
+                final_prompt = prompt_template.format_map({
+                    "context": context,
+                    "history": formatted_history,
+                    "question": user_message
+                })
+                
+                # Stream the answer field so callers can render it as it is generated
+                response_text = ""
+                answer_stream = AnswerStreamParser()
+                async for chunk in self._astream_complete(final_prompt):
+                    response_text = chunk.text
+                    answer_delta = answer_stream.feed(response_text)
+                    if answer_delta:
+                        ctx.write_event_to_stream(stream_chunk_event(delta=answer_delta))
+                
+                # Try to extract JSON response
+                json_response = await self._extract_json_from_llm_response(response_text)
+                
+                if json_response:
+                    await response_cache.set(cache_key, json_response)
+                    return StopEvent(result=json_response)
+                else:
+                    # Fallback to text response
+                    return StopEvent(result={
+                        "answer": response_text,
+                        "sources": [],
+                        "confidence": 0.7
+                    })
+        finally:
+            # A prefetch that was never awaited, or failed unawaited, is dropped cleanly
+            if prefetched_chunks is not None:
+                _discard_task(prefetched_chunks)
+    
+    @step
+    async def financial_rag_step(self, ctx: Context, ev: financial_rag_event) -> StopEvent:
+        """Handle specific financial queries with RAG"""
+        return await self._run_rag_step(ctx, ev, "FINANCIAL_RAG", RAG_PROMPT, top_k=6)
+    
+    @step
+    async def comparative_analysis_step(self, ctx: Context, ev: comparative_analysis_event) -> StopEvent:
+        """Handle comparative analysis queries with broader context for comparison"""
+        return await self._run_rag_step(ctx, ev, "COMPARATIVE_ANALYSIS", COMPARISON_PROMPT, top_k=10)
+    
+    @step
+    async def trend_analysis_step(self, ctx: Context, ev: trend_analysis_event) -> StopEvent:
+        """Handle trend analysis queries with historical context for trends"""
+        return await self._run_rag_step(ctx, ev, "TREND_ANALYSIS", TREND_PROMPT, top_k=12)
+    
+    @step
+    async def general_query_step(self, ctx: Context, ev: general_query_event) -> StopEvent:
+        """Handle general queries and greetings"""
+        
+        conversation_id = ev.conversation_id
+        user_message = ev.user_message
+        formatted_history = ev.formatted_history
+        
+        logger.info(f"Processing general query for conversation: {conversation_id}")
         
         # Generate response
-        final_prompt = general_prompt.format(
-            history=formatted_history,
-            message=user_message
-        )
+        final_prompt = GENERAL_PROMPT.format_map({
+            "history": formatted_history,
+            "message": user_message
+        })
         
-        response = await self.text_llm.acomplete(final_prompt)
+        # Stream the answer so callers can render it as it is generated
+        response_text = ""
+        async for chunk in self._astream_complete(final_prompt):
+            response_text = chunk.text
+            if chunk.delta:
+                ctx.write_event_to_stream(stream_chunk_event(delta=chunk.delta))
         
         return StopEvent(result={
-            "answer": response.text,
+            "answer": response_text,
             "sources": [],
             "confidence": 0.9
         })
 
 
+def _iso_timestamp(ts_ns: int) -> str:
+    """Format a time.time_ns() timestamp as a UTC ISO 8601 string"""
+    return datetime.fromtimestamp(ts_ns / 1e9, tz=timezone.utc).isoformat()
+
+
 class MAG7ConversationalAgent:
     """
     Main conversational agent for MAG7 Financial Intelligence Q&A System.
@@ -515,8 +859,82 @@ class MAG7ConversationalAgent:
     
     def __init__(self):
         """Initialize the conversational agent"""
-        self.workflow = MAG7FinancialWorkflow(timeout=60, verbose=True)
-        self.conversation_history = {}
+        verbose = os.getenv("MAG7_WORKFLOW_VERBOSE", "").lower() in ("1", "true", "yes")
+        self.workflow = MAG7FinancialWorkflow(timeout=60, verbose=verbose)
+        # Bound concurrent workflow runs so bursts don't trip Gemini rate limits
+        self._run_slots = asyncio.Semaphore(int(os.getenv("MAG7_MAX_CONCURRENCY", "32")))
+        # Each conversation keeps only its last 10 messages to manage memory
+        self.conversation_history = ConversationStore(max_messages=10)
+    
+    async def warmup(self):
+        """Open the vector store connection on the running event loop before the first query"""
+        try:
+            await warmup_pinecone_async()
+            logger.info("Vector store connection ready")
+        except Exception as e:
+            logger.warning(f"Vector store warmup failed: {e}")
+    
+    async def close(self):
+        """Close the vector store connections opened on the running event loop"""
+        try:
+            await close_async_pinecone()
+        except Exception as e:
+            logger.warning(f"Closing vector store connections failed: {e}")
+    
+    async def _build_payload(self, conversation_id: str, user_message: str, conversation_history: List[Dict] = None) -> Dict[str, Any]:
+        """Prepare the workflow payload, falling back to stored history"""
+        if conversation_history is None:
+            conversation_history = await self.conversation_history.get(conversation_id)
+        
+        return {
+            "conversation_id": conversation_id,
+            "user_message": user_message,
+            "conversation_history": conversation_history,
+            "formatted_history": format_conversation_context(conversation_history)
+        }
+    
+    def _extract_response(self, result: Any) -> Dict[str, Any]:
+        """Get the response dictionary from a workflow result"""
+        if isinstance(result, StopEvent):
+            result = result.result
+        if isinstance(result, dict):
+            return result
+        return {
+            "answer": "I apologize, but I encountered an error processing your request. Please try again.",
+            "sources": [],
+            "confidence": 0.0
+        }
+    
+    async def _record_turn(self, conversation_id: str, user_message: str, response: Dict[str, Any]) -> Dict[str, Any]:
+        """Add a user/assistant turn to the conversation history and build the result"""
+        # Timestamps are stored raw and only formatted when read back
+        ts_ns = time.time_ns()
+        
+        # Add user message and assistant response; awaited so a follow-up
+        # question always sees this turn
+        await self.conversation_history.append(
+            conversation_id,
+            {"role": "user", "content": user_message, "ts_ns": ts_ns},
+            {"role": "assistant", "content": response, "ts_ns": ts_ns}
+        )
+        
+        return {
+            "conversation_id": conversation_id,
+            "response": response,
+            "timestamp": _iso_timestamp(ts_ns)
+        }
+    
+    def _error_result(self, conversation_id: str, error: Exception) -> Dict[str, Any]:
+        """Build the result returned when processing fails"""
+        return {
+            "conversation_id": conversation_id,
+            "response": {
+                "answer": f"I apologize, but I encountered an error: {str(error)}. Please try again.",
+                "sources": [],
+                "confidence": 0.0
+            },
+            "timestamp": _iso_timestamp(time.time_ns())
+        }
     
     async def process_message(self, conversation_id: str, user_message: str, conversation_history: List[Dict] = None) -> Dict[str, Any]:
         """
@@ -531,79 +949,82 @@ class MAG7ConversationalAgent:
             Dictionary containing the response and metadata
         """
         try:
-            # Use provided history or get from stored history
-            if conversation_history is None:
-                conversation_history = self.conversation_history.get(conversation_id, [])
-            
-            # Prepare payload for workflow
-            payload = {
-                "conversation_id": conversation_id,
-                "user_message": user_message,
-                "conversation_history": conversation_history
-            }
+            payload = await self._build_payload(conversation_id, user_message, conversation_history)
             
             # Run the workflow
             logger.info(f"Processing message for conversation: {conversation_id}")
-            result = await self.workflow.run(payload=payload)
+            async with self._run_slots:
+                result = await self.workflow.run(payload=payload)
             
-            # Extract response
-            response = result.result if result and hasattr(result, 'result') else {
-                "answer": "I apologize, but I encountered an error processing your request. Please try again.",
-                "sources": [],
-                "confidence": 0.0
-            }
+            return await self._record_turn(conversation_id, user_message, self._extract_response(result))
             
-            # Update conversation history
-            if conversation_id not in self.conversation_history:
-                self.conversation_history[conversation_id] = []
+        except Exception as e:
+            logger.error(f"Error processing message: {e}")
+            return self._error_result(conversation_id, e)
+    
+    async def process_message_stream(self, conversation_id: str, user_message: str, conversation_history: List[Dict] = None) -> AsyncIterator[Union[str, Dict[str, Any]]]:
+        """
+        Process a user message, yielding the answer text as it is generated.
+        
+        Args:
+            conversation_id: Unique conversation identifier
+            user_message: User's input message
+            conversation_history: Previous conversation messages
             
-            # Add user message
-            self.conversation_history[conversation_id].append({
-                "role": "user",
-                "content": user_message,
-                "timestamp": datetime.utcnow().isoformat()
-            })
+        Yields:
+            Answer text chunks, followed by the same dictionary process_message returns
+        """
+        try:
+            payload = await self._build_payload(conversation_id, user_message, conversation_history)
             
-            # Add assistant response
-            self.conversation_history[conversation_id].append({
-                "role": "assistant",
-                "content": response,
-                "timestamp": datetime.utcnow().isoformat()
-            })
+            # Run the workflow and forward streamed text
+            logger.info(f"Streaming message for conversation: {conversation_id}")
+            async with self._run_slots:
+                handler = self.workflow.run(payload=payload)
+                streamed = False
+                async for ev in handler.stream_events():
+                    if isinstance(ev, stream_chunk_event):
+                        streamed = True
+                        yield ev.delta
+                
+                response = self._extract_response(await handler)
             
-            # Keep only last 10 messages to manage memory
-            if len(self.conversation_history[conversation_id]) > 10:
-                self.conversation_history[conversation_id] = self.conversation_history[conversation_id][-10:]
+            # Branches that don't stream deliver the whole answer at once
+            if not streamed:
+                yield str(response.get("answer", ""))
             
-            return {
-                "conversation_id": conversation_id,
-                "response": response,
-                "timestamp": datetime.utcnow().isoformat()
-            }
+            yield await self._record_turn(conversation_id, user_message, response)
             
         except Exception as e:
             logger.error(f"Error processing message: {e}")
-            return {
-                "conversation_id": conversation_id,
-                "response": {
-                    "answer": f"I apologize, but I encountered an error: {str(e)}. Please try again.",
-                    "sources": [],
-                    "confidence": 0.0
-                },
-                "timestamp": datetime.utcnow().isoformat()
-            }
+            result = self._error_result(conversation_id, e)
+            yield result["response"]["answer"]
+            yield result
+    
+    async def record_turn(self, conversation_id: str, user_message: str, response: Dict[str, Any]) -> Dict[str, Any]:
+        """Add a turn answered outside the workflow, such as from a UI cache, to the conversation history"""
+        return await self._record_turn(conversation_id, user_message, response)
     
-    def get_conversation_history(self, conversation_id: str) -> List[Dict]:
+    async def get_conversation_history(self, conversation_id: str) -> List[Dict]:
         """Get conversation history for a specific conversation"""
-        return self.conversation_history.get(conversation_id, [])
+        return [
+            {"role": msg["role"], "content": msg["content"], "timestamp": _iso_timestamp(msg["ts_ns"])}
+            for msg in await self.conversation_history.get(conversation_id)
+        ]
     
-    def clear_conversation_history(self, conversation_id: str) -> bool:
+    async def clear_conversation_history(self, conversation_id: str) -> bool:
         """Clear conversation history for a specific conversation"""
-        if conversation_id in self.conversation_history:
-            del self.conversation_history[conversation_id]
-            return True
-        return False
+        return await self.conversation_history.clear(conversation_id)
+
+
+@functools.lru_cache(maxsize=1)
+def get_agent() -> MAG7ConversationalAgent:
+    """Create the shared agent on first use"""
+    return MAG7ConversationalAgent()
 
 
-# Singleton instance
-mag7_agent = MAG7ConversationalAgent() 
\ No newline at end of file
+def __getattr__(name: str):
+    # Keep `from conversational_agent import mag7_agent` working without building the agent at import
+    if name == "mag7_agent":
+        return get_agent()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
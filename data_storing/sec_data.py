@@ -1,15 +1,85 @@
-import requests
+import asyncio
+import contextlib
 import json
-import time
 import os
+import queue
+import random
 from datetime import datetime, timedelta
 from pathlib import Path
 import logging
-from typing import Dict, List, Optional
+import logging.handlers
+from typing import Dict, Iterator, List, Optional, Tuple
 import re
 from urllib.parse import urljoin
 import pandas as pd
-from bs4 import BeautifulSoup
+import httpx
+import aiofiles
+from aiolimiter import AsyncLimiter
+
+# orjson decodes the multi-MB submissions JSON and writes metadata faster when available
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# pyarrow serializes the metadata table in C and adds a Parquet copy when available
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pa_parquet
+except ImportError:
+    pa = None
+
+# httpx can only decode Brotli responses when the brotli package is installed
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ACCEPT_ENCODING = "gzip, deflate, br" if brotli is not None else "gzip, deflate"
+
+# Link targets on a filing index page
+HREF_RE = re.compile(r'<a\s[^>]*?href\s*=\s*["\']([^"\']+)["\']', re.IGNORECASE)
+
+# Index links that may point at the main filing document
+DOCUMENT_LINK_RE = re.compile(r'10k|10q|main|index', re.IGNORECASE)
+NON_DOCUMENT_EXTENSIONS = ('.xml', '.xsd', '.jpg', '.png', '.gif')
+
+def _dump_json(obj, indent: bool = False) -> bytes:
+    """
+    Serialize an object to JSON bytes, with orjson when it is installed
+    
+    Args:
+        obj: Object to serialize
+        indent: Whether to pretty-print with two-space indentation
+        
+    Returns:
+        UTF-8 encoded JSON
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    return json.dumps(obj, indent=2 if indent else None).encode('utf-8')
+
+@contextlib.contextmanager
+def _queued_logging():
+    """
+    Route root log records through a queue so logging callers never block on handler I/O
+    """
+    root = logging.getLogger()
+    handlers = root.handlers[:]
+    if not handlers:
+        yield
+        return
+    
+    log_queue = queue.Queue(-1)
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    listener.start()
+    try:
+        yield
+    finally:
+        listener.stop()
+        root.handlers = handlers
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -35,7 +105,7 @@ class SECFilingScraper:
         # SEC requires user agent for API access
         self.api_headers = {
             "User-Agent": user_agent,
-            "Accept-Encoding": "gzip, deflate",
+            "Accept-Encoding": ACCEPT_ENCODING,
             "Host": "data.sec.gov"
         }
         
@@ -44,8 +114,7 @@ class SECFilingScraper:
             "User-Agent": user_agent,
             "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
             "Accept-Language": "en-US,en;q=0.5",
-            "Accept-Encoding": "gzip, deflate",
-            "Connection": "keep-alive",
+            "Accept-Encoding": ACCEPT_ENCODING,
             "Upgrade-Insecure-Requests": "1"
         }
         
@@ -68,17 +137,188 @@ class SECFilingScraper:
         self.end_date = "2025-12-31"
         
         # Rate limiting (SEC allows 10 requests per second)
-        self.rate_limit_delay = 0.1
+        self.requests_per_second = 10
+        self.max_concurrent_requests = 10
+        
+        # Connection pool shared by data.sec.gov and www.sec.gov, kept alive between requests.
+        # Over HTTP/2 each host needs only one connection, multiplexing concurrent requests.
+        self.http2 = True
+        self.max_connections = 20
+        self.keepalive_timeout = 85
+        
+        # Filing bodies are streamed to disk in chunks of this many bytes
+        self.download_chunk_size = 65536
+        
+        # Per connect/read timeouts, so large filings can take longer than 30s overall
+        self.request_timeout = httpx.Timeout(30.0)
+        
+        # Retries with exponential backoff when SEC pushes back
+        self.retry_statuses = {429, 503}
+        self.max_retries = 4
         
         # Create data directory
         self.data_dir = Path("sec_filings_data")
         self.data_dir.mkdir(exist_ok=True)
         
-    def get_company_submissions(self, cik: str) -> Dict:
+        # Submissions responses cached with their validators for conditional requests
+        self.cache_dir = self.data_dir / ".cache"
+        self.cache_dir.mkdir(exist_ok=True)
+        
+        # Primary document URLs resolved on previous runs, keyed by accession number
+        self.url_cache_path = self.data_dir / ".url_cache.json"
+        self._url_cache = self._load_url_cache()
+        
+        # Finished filings queued for the JSONL log writer during scrape_all_filings
+        self._results_queue = None
+        
+    def _load_url_cache(self) -> Dict[str, str]:
+        """
+        Load the resolved primary document URLs saved by earlier runs
+        
+        Returns:
+            Dictionary mapping accession numbers to document URLs
+        """
+        if not self.url_cache_path.exists():
+            return {}
+        try:
+            with open(self.url_cache_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable URL cache {self.url_cache_path}: {e}")
+            return {}
+    
+    def _save_url_cache(self):
+        """
+        Persist the resolved primary document URLs for the next run
+        """
+        with open(self.url_cache_path, 'w') as f:
+            json.dump(self._url_cache, f, indent=2)
+    
+    def _prepare_company_dirs(self):
+        """
+        Create each company's directory once and list the filings already downloaded there
+        """
+        self._company_dirs = {}
+        self._existing_files = {}
+        for company_symbol in self.companies:
+            company_dir = self.data_dir / company_symbol
+            company_dir.mkdir(exist_ok=True)
+            self._company_dirs[company_symbol] = company_dir
+            self._existing_files[company_symbol] = set(os.listdir(company_dir))
+    
+    @contextlib.asynccontextmanager
+    async def _open_session(self):
+        """
+        Open the HTTP session and rate limiter shared by all requests of one run
+        
+        Yields:
+            httpx async client
+        """
+        self._prepare_company_dirs()
+        self._semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+        self._limiter = AsyncLimiter(self.requests_per_second, 1)
+        limits = httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_connections,
+            keepalive_expiry=self.keepalive_timeout
+        )
+        try:
+            async with httpx.AsyncClient(http2=self.http2, limits=limits, timeout=self.request_timeout) as session:
+                await self._prewarm(session)
+                yield session
+        finally:
+            self._save_url_cache()
+    
+    async def _prewarm(self, session: httpx.AsyncClient):
+        """
+        Resolve and connect to both SEC hosts up front so the first downloads don't pay for it
+        
+        Args:
+            session: HTTP session for the current run
+        """
+        async def warm(url: str, headers: Dict):
+            try:
+                async with self._limiter:
+                    await session.head(url, headers=headers)
+            except httpx.HTTPError as e:
+                logger.info(f"Prewarming {url} failed: {e}")
+        
+        await asyncio.gather(
+            warm(self.submissions_url, self.api_headers),
+            warm(self.filing_url, self.filing_headers)
+        )
+    
+    @contextlib.asynccontextmanager
+    async def _request(self, session: httpx.AsyncClient, url: str, headers: Dict):
+        """
+        GET a URL within SEC's rate limit, backing off on 429/503 responses
+        
+        Args:
+            session: HTTP session for the current run
+            url: URL to fetch
+            headers: Request headers for the target host
+            
+        Yields:
+            Response whose body hasn't been read yet
+        """
+        for attempt in range(self.max_retries + 1):
+            async with self._semaphore, self._limiter:
+                async with session.stream('GET', url, headers=headers) as response:
+                    if response.status_code not in self.retry_statuses or attempt == self.max_retries:
+                        yield response
+                        return
+            
+            delay = 2 ** attempt + random.random()
+            logger.warning(f"{url} returned status {response.status_code}, retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+    
+    async def _get(self, session: httpx.AsyncClient, url: str, headers: Dict) -> Tuple[int, str]:
+        """
+        GET a URL within SEC's rate limit and read its body as text
+        
+        Args:
+            session: HTTP session for the current run
+            url: URL to fetch
+            headers: Request headers for the target host
+            
+        Returns:
+            Tuple of HTTP status and response text
+        """
+        async with self._request(session, url, headers) as response:
+            await response.aread()
+            return response.status_code, response.text
+    
+    def _cache_path(self, cik: str) -> Path:
+        """
+        Path of the cached submissions JSON for a company
+        
+        Args:
+            cik: Company's Central Index Key
+            
+        Returns:
+            Cache file path; its validators are stored alongside with a .headers.json suffix
+        """
+        return self.cache_dir / f"CIK{cik.zfill(10)}.json"
+    
+    @staticmethod
+    def _write_atomic(path: Path, data: bytes):
+        """
+        Write a file via a temporary file and rename so readers never see a partial write
+        
+        Args:
+            path: Destination path
+            data: File contents
+        """
+        tmp_path = path.with_name(path.name + ".tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+    
+    async def get_company_submissions(self, session: httpx.AsyncClient, cik: str) -> Dict:
         """
         Get all submissions for a company using SEC submissions API
         
         Args:
+            session: HTTP session for the current run
             cik: Company's Central Index Key
             
         Returns:
@@ -88,13 +328,35 @@ class SECFilingScraper:
         cik_padded = cik.zfill(10)
         url = f"{self.submissions_url}CIK{cik_padded}.json"
         
+        # Revalidate the cached copy instead of downloading it again
+        cache_path = self._cache_path(cik)
+        headers_path = cache_path.with_suffix(".headers.json")
+        headers = dict(self.api_headers)
+        if cache_path.exists() and headers_path.exists():
+            validators = json.loads(headers_path.read_text())
+            if validators.get('etag'):
+                headers['If-None-Match'] = validators['etag']
+            if validators.get('last_modified'):
+                headers['If-Modified-Since'] = validators['last_modified']
+        
         try:
             logger.info(f"Fetching submissions from: {url}")
-            response = requests.get(url, headers=self.api_headers)
-            response.raise_for_status()
-            time.sleep(self.rate_limit_delay)
+            async with self._request(session, url, headers) as response:
+                if response.status_code == 304:
+                    logger.info(f"Submissions for CIK {cik} unchanged, using cached copy")
+                    body = cache_path.read_bytes()
+                elif response.status_code == 200:
+                    body = await response.aread()
+                    self._write_atomic(cache_path, body)
+                    self._write_atomic(headers_path, json.dumps({
+                        'etag': response.headers.get('ETag'),
+                        'last_modified': response.headers.get('Last-Modified')
+                    }).encode())
+                else:
+                    logger.error(f"Error fetching submissions for CIK {cik}: HTTP {response.status_code}")
+                    return {}
             
-            data = response.json()
+            data = orjson.loads(body) if orjson is not None else json.loads(body)
             
             # Debug: Log the structure of the response
             logger.debug(f"Response keys: {list(data.keys()) if isinstance(data, dict) else 'Not a dict'}")
@@ -104,7 +366,7 @@ class SECFilingScraper:
                     logger.debug(f"Recent filings keys: {list(data['filings']['recent'].keys())}")
             
             return data
-        except requests.RequestException as e:
+        except (httpx.HTTPError, ValueError) as e:
             logger.error(f"Error fetching submissions for CIK {cik}: {e}")
             return {}
     
@@ -124,7 +386,6 @@ class SECFilingScraper:
             return []
         
         filings = submissions['filings']['recent']
-        filtered_filings = []
         
         # Debug: Log available keys in filings
         logger.debug(f"Available keys in filings: {list(filings.keys())}")
@@ -137,58 +398,43 @@ class SECFilingScraper:
             logger.error(f"Available fields: {list(filings.keys())}")
             return []
         
-        for i in range(len(filings['form'])):
-            form_type = filings['form'][i]
-            filing_date = filings['filingDate'][i]
-            
-            # Check if it's a target filing type
-            if form_type in self.filing_types:
-                # Check if within date range
-                if self.start_date <= filing_date <= self.end_date:
-                    filing_info = {
-                        'company': company_symbol,
-                        'form_type': form_type,
-                        'filing_date': filing_date,
-                        'accession_number': filings['accessionNumber'][i],
-                        'primary_document': filings['primaryDocument'][i],
-                        'report_date': filings['reportDate'][i],
-                        'cik': filings.get('cik', [None] * len(filings['form']))[i] if 'cik' in filings else None
-                    }
-                    filtered_filings.append(filing_info)
-        
-        return filtered_filings
-    
-    def construct_filing_url(self, filing_info: Dict) -> str:
-        """
-        Construct the direct URL to the filing document with fallback strategies
+        df = pd.DataFrame({
+            'company': company_symbol,
+            'form_type': filings['form'],
+            'filing_date': filings['filingDate'],
+            'accession_number': filings['accessionNumber'],
+            'primary_document': filings['primaryDocument'],
+            'report_date': filings['reportDate'],
+            'cik': filings.get('cik') or None
+        })
+        
+        # Keep target filing types within the date range (ISO dates compare as strings)
+        mask = df['form_type'].isin(self.filing_types) & df['filing_date'].between(self.start_date, self.end_date)
+        df = df.loc[mask]
+        
+        # Every filing carries a CIK, falling back to the company's own where submissions has none
+        company_cik = self.companies[company_symbol]
+        df = df.assign(cik=df['cik'].where(df['cik'].notna() & (df['cik'] != ''), company_cik))
+        return df.to_dict(orient='records')
+    
+    def _iter_filing_urls(self, filing_info: Dict) -> Iterator[str]:
+        """
+        Lazily generate candidate URLs for the filing document, most likely first
         
         Args:
             filing_info: Dictionary containing filing information
             
-        Returns:
-            Direct URL to the filing document
-        """
-        # Use CIK from filing_info if available, otherwise use the company's CIK
-        cik = filing_info.get('cik')
-        if cik is None:
-            # Fallback to company's CIK from our mapping
-            company_symbol = filing_info['company']
-            cik = self.companies.get(company_symbol)
-            if cik is None:
-                raise ValueError(f"No CIK found for company {company_symbol}")
-        
-        cik = str(cik)
-        accession_number = filing_info['accession_number'].replace('-', '')
+        Yields:
+            Candidate URL for the filing document
+        """
+        base_url = f"{self.filing_url}{filing_info['cik']}/{filing_info['accession_number'].replace('-', '')}/"
         primary_document = filing_info['primary_document']
         
-        # Try multiple URL patterns for SEC filings
-        url_patterns = []
-        
         # Pattern 1: Use the primary_document as provided
         if primary_document:
-            url_patterns.append(f"{self.filing_url}{cik}/{accession_number}/{primary_document}")
+            yield f"{base_url}{primary_document}"
         
-        # Pattern 2: Common document name patterns
+        # Pattern 2: Common document name patterns, only built if pattern 1 failed
         company_lower = filing_info['company'].lower()
         form_type = filing_info['form_type']
         filing_date = filing_info['filing_date']
@@ -219,22 +465,112 @@ class SECFilingScraper:
         ]
         
         for pattern in common_patterns:
-            url_patterns.append(f"{self.filing_url}{cik}/{accession_number}/{pattern}")
+            yield f"{base_url}{pattern}"
+    
+    async def _fetch_text(self, session: httpx.AsyncClient, url: str) -> Optional[str]:
+        """
+        Fetch a filing page, returning its text or None if it isn't available
         
-        return url_patterns
+        Args:
+            session: HTTP session for the current run
+            url: URL to fetch
+            
+        Returns:
+            Response text, or None for a non-200 status
+        """
+        status, text = await self._get(session, url, self.filing_headers)
+        if status != 200:
+            logger.info(f"{url} returned status {status}")
+            return None
+        return text
     
-    def download_filing(self, filing_info: Dict) -> Optional[str]:
+
+    
+    async def _stream_to_file(self, session: httpx.AsyncClient, url: str, filepath: Path) -> bool:
+        """
+        Stream a filing document straight to disk without buffering it in memory
+        
+        Args:
+            session: HTTP session for the current run
+            url: URL of the document
+            filepath: Destination path
+            
+        Returns:
+            True if the document was saved, False for a non-200 status
+        """
+        # Write to a temporary file so an interrupted download never looks complete
+        partial_path = filepath.with_name(filepath.name + ".part")
+        async with self._request(session, url, self.filing_headers) as response:
+            if response.status_code != 200:
+                logger.info(f"{url} returned status {response.status_code}")
+                return False
+            
+            decoded_bytes = 0
+            async with aiofiles.open(partial_path, 'wb') as f:
+                async for chunk in response.aiter_bytes(self.download_chunk_size):
+                    await f.write(chunk)
+                    decoded_bytes += len(chunk)
+            
+            # Content-Length counts the encoded bytes actually sent over the wire
+            logger.debug(
+                f"{url}: {response.headers.get('Content-Length', 'unknown')} bytes transferred "
+                f"({response.headers.get('Content-Encoding', 'identity')}), {decoded_bytes} bytes decoded"
+            )
+        
+        os.replace(partial_path, filepath)
+        return True
+    
+    async def _resolve_primary(self, session: httpx.AsyncClient, filing_info: Dict) -> Optional[str]:
+        """
+        Resolve the URL of a filing's primary document from the accession's index.json
+        
+        Args:
+            session: HTTP session for the current run
+            filing_info: Dictionary containing filing information
+            
+        Returns:
+            URL of the primary document, or None if the index couldn't be read
+        """
+        accession = filing_info['accession_number']
+        if accession in self._url_cache:
+            return self._url_cache[accession]
+        
+        cik = filing_info['cik']
+        base_url = f"{self.filing_url}{cik}/{accession.replace('-', '')}/"
+        
+        status, text = await self._get(session, f"{base_url}index.json", self.filing_headers)
+        if status != 200:
+            logger.info(f"index.json for {accession} returned status {status}")
+            return None
+        
+        names = [item['name'] for item in json.loads(text).get('directory', {}).get('item', [])]
+        
+        # Prefer the primary document named in the submissions data, else the first HTML document
+        primary_document = filing_info.get('primary_document')
+        if primary_document not in names:
+            primary_document = next(
+                (name for name in names if name.endswith('.htm') and not name.endswith('-index.htm')),
+                None
+            )
+        if primary_document is None:
+            logger.info(f"No primary document listed in index.json for {accession}")
+            return None
+        
+        url = f"{base_url}{primary_document}"
+        self._url_cache[accession] = url
+        return url
+    
+    async def download_filing(self, session: httpx.AsyncClient, filing_info: Dict) -> Optional[str]:
         """
         Download a single filing document with multiple URL attempts
         
         Args:
+            session: HTTP session for the current run
             filing_info: Dictionary containing filing information
             
         Returns:
             Path to downloaded file or None if failed
         """
-        url_patterns = self.construct_filing_url(filing_info)
-        
         # Create filename
         company = filing_info['company']
         form_type = filing_info['form_type']
@@ -242,66 +578,60 @@ class SECFilingScraper:
         accession = filing_info['accession_number']
         
         filename = f"{company}{form_type}{filing_date}_{accession}.html"
-        filepath = self.data_dir / company / filename
-        
-        # Create company directory
-        (self.data_dir / company).mkdir(exist_ok=True)
+        filepath = self._company_dirs[company] / filename
         
         # Skip if file already exists
-        if filepath.exists():
+        if filename in self._existing_files[company]:
             logger.info(f"File already exists: {filename}")
             return str(filepath)
         
-        # Try each URL pattern
-        for i, url in enumerate(url_patterns):
+        # Resolve the primary document from the filing index
+        try:
+            url = await self._resolve_primary(session, filing_info)
+            if url is not None:
+                logger.info(f"Downloading primary document: {url}")
+                if await self._stream_to_file(session, url, filepath):
+                    logger.info(f"Downloaded: {filename}")
+                    return str(filepath)
+        
+        except (httpx.HTTPError, ValueError) as e:
+            logger.info(f"Resolving primary document failed: {e}")
+        
+        # Fall back to guessing the document URL if the index couldn't be used
+        for i, url in enumerate(self._iter_filing_urls(filing_info), 1):
             try:
-                logger.info(f"Trying URL {i+1}/{len(url_patterns)}: {url}")
-                
-                # Download with appropriate headers
-                response = requests.get(url, headers=self.filing_headers, timeout=30)
+                logger.info(f"Trying URL {i}: {url}")
                 
-                if response.status_code == 200:
-                    # Save the filing
-                    with open(filepath, 'w', encoding='utf-8') as f:
-                        f.write(response.text)
-                    
-                    logger.info(f"Downloaded: {filename} (URL pattern {i+1})")
-                    time.sleep(self.rate_limit_delay)
+                # Download with appropriate headers and save the filing
+                if await self._stream_to_file(session, url, filepath):
+                    logger.info(f"Downloaded: {filename} (URL pattern {i})")
                     return str(filepath)
-                else:
-                    logger.info(f"URL {i+1} returned status {response.status_code}")
-                    
-            except requests.RequestException as e:
-                logger.info(f"URL {i+1} failed: {e}")
+            
+            except httpx.HTTPError as e:
+                logger.info(f"URL {i} failed: {e}")
                 continue
         
         # If all patterns failed, try to get the filing index first
         try:
-            index_url = f"{self.filing_url}{filing_info.get('cik', self.companies[filing_info['company']])}/{filing_info['accession_number'].replace('-', '')}/index.htm"
+            filing_base_url = f"{self.filing_url}{filing_info['cik']}/{filing_info['accession_number'].replace('-', '')}/"
+            index_url = f"{filing_base_url}index.htm"
             logger.info(f"Trying index URL: {index_url}")
             
-            response = requests.get(index_url, headers=self.filing_headers, timeout=30)
-            if response.status_code == 200:
-                # Parse the index to find the main document
-                soup = BeautifulSoup(response.text, 'html.parser')
-                
-                # Look for links to main documents
-                for link in soup.find_all('a', href=True):
-                    href = link['href']
-                    if any(keyword in href.lower() for keyword in ['10k', '10q', 'main', 'index']):
-                        main_url = f"{self.filing_url}{filing_info.get('cik', self.companies[filing_info['company']])}/{filing_info['accession_number'].replace('-', '')}/{href}"
+            index_text = await self._fetch_text(session, index_url)
+            if index_text is not None:
+                # Look for links to main documents in the index
+                for href in HREF_RE.findall(index_text):
+                    if href.lower().endswith(NON_DOCUMENT_EXTENSIONS):
+                        continue
+                    if DOCUMENT_LINK_RE.search(href):
+                        main_url = f"{filing_base_url}{href}"
                         
                         try:
                             logger.info(f"Trying main document URL: {main_url}")
-                            main_response = requests.get(main_url, headers=self.filing_headers, timeout=30)
-                            if main_response.status_code == 200:
-                                with open(filepath, 'w', encoding='utf-8') as f:
-                                    f.write(main_response.text)
-                                
+                            if await self._stream_to_file(session, main_url, filepath):
                                 logger.info(f"Downloaded: {filename} (via index)")
-                                time.sleep(self.rate_limit_delay)
                                 return str(filepath)
-                        except requests.RequestException as e:
+                        except httpx.HTTPError as e:
                             logger.info(f"Main document URL failed: {e}")
                             continue
         except Exception as e:
@@ -312,20 +642,27 @@ class SECFilingScraper:
     
     def save_filing_metadata(self, all_filings: List[Dict]):
         """
-        Save filing metadata to JSON and CSV files
+        Save filing metadata to JSON, CSV and (with pyarrow) Parquet files
         
         Args:
             all_filings: List of all filing dictionaries
         """
         # Save as JSON
         metadata_json = self.data_dir / "filing_metadata.json"
-        with open(metadata_json, 'w') as f:
-            json.dump(all_filings, f, indent=2)
+        with open(metadata_json, 'wb') as f:
+            f.write(_dump_json(all_filings, indent=True))
         
         # Save as CSV for easy analysis
         metadata_csv = self.data_dir / "filing_metadata.csv"
-        df = pd.DataFrame(all_filings)
-        df.to_csv(metadata_csv, index=False)
+        if pa is not None:
+            table = pa.Table.from_pylist(all_filings)
+            pa_csv.write_csv(table, metadata_csv)
+            
+            # Columnar copy for downstream analysis
+            pa_parquet.write_table(table, self.data_dir / "filing_metadata.parquet", compression='zstd')
+        else:
+            df = pd.DataFrame(all_filings)
+            df.to_csv(metadata_csv, index=False)
         
         logger.info(f"Saved metadata: {len(all_filings)} filings")
     
@@ -339,37 +676,37 @@ class SECFilingScraper:
         Returns:
             Dictionary containing filing statistics
         """
-        stats = {
-            'total_filings': len(all_filings),
-            'by_company': {},
-            'by_form_type': {},
-            'by_year': {},
+        df = pd.DataFrame(all_filings, columns=['company', 'form_type', 'filing_date'])
+        
+        def count_by(values: pd.Series) -> Dict[str, int]:
+            # Keys in order of first appearance, as plain ints so the stats stay JSON-serializable
+            return {key: int(count) for key, count in values.groupby(values, sort=False).size().items()}
+        
+        return {
+            'total_filings': len(df),
+            'by_company': count_by(df['company']),
+            'by_form_type': count_by(df['form_type']),
+            'by_year': count_by(df['filing_date'].str[:4]),
             'date_range': {
-                'earliest': min([f['filing_date'] for f in all_filings]) if all_filings else None,
-                'latest': max([f['filing_date'] for f in all_filings]) if all_filings else None
+                'earliest': df['filing_date'].min() if len(df) else None,
+                'latest': df['filing_date'].max() if len(df) else None
             }
         }
-        
-        for filing in all_filings:
-            company = filing['company']
-            form_type = filing['form_type']
-            year = filing['filing_date'][:4]
-            
-            # Count by company
-            stats['by_company'][company] = stats['by_company'].get(company, 0) + 1
-            
-            # Count by form type
-            stats['by_form_type'][form_type] = stats['by_form_type'].get(form_type, 0) + 1
-            
-            # Count by year
-            stats['by_year'][year] = stats['by_year'].get(year, 0) + 1
-        
-        return stats
     
     def test_single_filing_download(self, company_symbol: str, filing_date: str = None):
         """
         Test downloading a single filing for debugging purposes
         
+        Args:
+            company_symbol: Company symbol (e.g., 'AAPL')
+            filing_date: Specific filing date to test (optional)
+        """
+        asyncio.run(self.test_single_filing_download_async(company_symbol, filing_date))
+    
+    async def test_single_filing_download_async(self, company_symbol: str, filing_date: str = None):
+        """
+        Test downloading a single filing for debugging purposes
+        
         Args:
             company_symbol: Company symbol (e.g., 'AAPL')
             filing_date: Specific filing date to test (optional)
@@ -381,8 +718,21 @@ class SECFilingScraper:
         cik = self.companies[company_symbol]
         logger.info(f"Testing single filing download for {company_symbol} (CIK: {cik})")
         
+        async with self._open_session() as session:
+            await self._test_single_filing_download(session, company_symbol, cik, filing_date)
+    
+    async def _test_single_filing_download(self, session: httpx.AsyncClient, company_symbol: str, cik: str, filing_date: str = None):
+        """
+        Run the single filing download test within an open session
+        
+        Args:
+            session: HTTP session for the current run
+            company_symbol: Company symbol (e.g., 'AAPL')
+            cik: Company's Central Index Key
+            filing_date: Specific filing date to test (optional)
+        """
         # Get company submissions
-        submissions = self.get_company_submissions(cik)
+        submissions = await self.get_company_submissions(session, cik)
         if not submissions:
             logger.error(f"No submissions found for {company_symbol}")
             return
@@ -404,14 +754,12 @@ class SECFilingScraper:
         test_filing = company_filings[0]
         logger.info(f"Testing filing: {test_filing}")
         
-        # Test URL construction
-        url_patterns = self.construct_filing_url(test_filing)
-        logger.info(f"Generated {len(url_patterns)} URL patterns:")
-        for i, url in enumerate(url_patterns[:5]):  # Show first 5 patterns
-            logger.info(f"  Pattern {i+1}: {url}")
+        # Test primary document resolution
+        primary_url = await self._resolve_primary(session, test_filing)
+        logger.info(f"Resolved primary document: {primary_url}")
         
         # Test download
-        result = self.download_filing(test_filing)
+        result = await self.download_filing(session, test_filing)
         if result:
             logger.info(f"SUCCESS: Downloaded to {result}")
         else:
@@ -421,6 +769,99 @@ class SECFilingScraper:
         """
         Main method to scrape all MAG7 company filings
         
+        Returns:
+            Dictionary containing scraping results and statistics
+        """
+        return asyncio.run(self.scrape_all_filings_async())
+    
+    async def _process_company(self, session: httpx.AsyncClient, company_symbol: str, cik: str) -> Tuple[List[Dict], List[Dict]]:
+        """
+        Fetch, filter and download one company's filings
+        
+        Args:
+            session: HTTP session for the current run
+            company_symbol: Company stock symbol
+            cik: Company's Central Index Key
+            
+        Returns:
+            Tuple of the company's filings and their download results
+        """
+        logger.info(f"\nProcessing {company_symbol} (CIK: {cik})")
+        
+        # Get company submissions
+        submissions = await self.get_company_submissions(session, cik)
+        if not submissions:
+            logger.warning(f"No submissions found for {company_symbol}")
+            return [], []
+        
+        # Filter for target filings
+        company_filings = self.filter_filings(submissions, company_symbol)
+        logger.info(f"Found {len(company_filings)} filings for {company_symbol}")
+        
+        # Download the company's filings concurrently
+        async with asyncio.TaskGroup() as tg:
+            downloads = [tg.create_task(self._download_and_record(session, filing_info)) for filing_info in company_filings]
+        
+        return company_filings, [download.result() for download in downloads]
+    
+    async def _download_and_record(self, session: httpx.AsyncClient, filing_info: Dict) -> Dict:
+        """
+        Download a filing and queue it and its result for the run's JSONL logs
+        
+        Args:
+            session: HTTP session for the current run
+            filing_info: Dictionary containing filing information
+            
+        Returns:
+            Download result dictionary
+        """
+        # Filings an earlier run saved are found on disk by download_filing, before any request
+        filepath = await self.download_filing(session, filing_info)
+        
+        result = {
+            'company': filing_info['company'],
+            'form_type': filing_info['form_type'],
+            'filing_date': filing_info['filing_date'],
+            'success': filepath is not None,
+            'filepath': filepath
+        }
+        
+        if self._results_queue is not None:
+            self._results_queue.put_nowait((filing_info, result))
+        
+        return result
+    
+    async def _results_writer(self, results_queue: asyncio.Queue, metadata_log, results_log):
+        """
+        Append queued filings and results to the JSONL logs in batches until a None sentinel
+        
+        Args:
+            results_queue: Queue of (filing_info, result) tuples
+            metadata_log: Binary file receiving filing metadata lines
+            results_log: Binary file receiving download result lines
+        """
+        done = False
+        while not done:
+            batch = [await results_queue.get()]
+            while not results_queue.empty():
+                batch.append(results_queue.get_nowait())
+            
+            for item in batch:
+                if item is None:
+                    done = True
+                    continue
+                filing_info, result = item
+                metadata_log.write(_dump_json(filing_info) + b"\n")
+                results_log.write(_dump_json(result) + b"\n")
+            
+            # Progress survives a crash mid-run
+            metadata_log.flush()
+            results_log.flush()
+    
+    async def scrape_all_filings_async(self) -> Dict:
+        """
+        Scrape all MAG7 company filings, processing every company and filing concurrently
+        
         Returns:
             Dictionary containing scraping results and statistics
         """
@@ -432,31 +873,31 @@ class SECFilingScraper:
         all_filings = []
         download_results = []
         
-        for company_symbol, cik in self.companies.items():
-            logger.info(f"\nProcessing {company_symbol} (CIK: {cik})")
-            
-            # Get company submissions
-            submissions = self.get_company_submissions(cik)
-            if not submissions:
-                logger.warning(f"No submissions found for {company_symbol}")
-                continue
-            
-            # Filter for target filings
-            company_filings = self.filter_filings(submissions, company_symbol)
-            logger.info(f"Found {len(company_filings)} filings for {company_symbol}")
-            
-            # Download each filing
-            for filing_info in company_filings:
-                all_filings.append(filing_info)
-                filepath = self.download_filing(filing_info)
-                
-                download_results.append({
-                    'company': company_symbol,
-                    'form_type': filing_info['form_type'],
-                    'filing_date': filing_info['filing_date'],
-                    'success': filepath is not None,
-                    'filepath': filepath
-                })
+        # Companies share the session's rate limiter, so SEC's limit holds across all of them
+        with open(self.data_dir / "filing_metadata.jsonl", 'wb') as metadata_log, \
+                open(self.data_dir / "download_results.jsonl", 'wb') as results_log, \
+                _queued_logging():
+            self._results_queue = asyncio.Queue()
+            writer = asyncio.create_task(self._results_writer(self._results_queue, metadata_log, results_log))
+            try:
+                # One task group for all companies, so a failing company cancels the others
+                # before the shared session closes
+                async with self._open_session() as session:
+                    async with asyncio.TaskGroup() as tg:
+                        company_tasks = [
+                            tg.create_task(self._process_company(session, company_symbol, cik))
+                            for company_symbol, cik in self.companies.items()
+                        ]
+                company_results = [task.result() for task in company_tasks]
+            finally:
+                # Let the writer drain everything recorded so far, even if the run failed
+                self._results_queue.put_nowait(None)
+                self._results_queue = None
+                await writer
+        
+        for company_filings, company_download_results in company_results:
+            all_filings.extend(company_filings)
+            download_results.extend(company_download_results)
         
         # Save metadata
         self.save_filing_metadata(all_filings)
@@ -466,8 +907,8 @@ class SECFilingScraper:
         
         # Save download results
         results_file = self.data_dir / "download_results.json"
-        with open(results_file, 'w') as f:
-            json.dump(download_results, f, indent=2)
+        with open(results_file, 'wb') as f:
+            f.write(_dump_json(download_results, indent=True))
         
         # Print summary
         logger.info(f"\n{'='*50}")
@@ -494,6 +935,18 @@ def main():
     """
     Main function to run the SEC filing scraper
     """
+    # Use uvloop for faster async I/O when available, or winloop on Windows
+    # where uvloop isn't supported; otherwise keep the default asyncio loop
+    try:
+        import uvloop as fast_loop
+    except ImportError:
+        try:
+            import winloop as fast_loop
+        except ImportError:
+            fast_loop = None
+    if fast_loop is not None:
+        fast_loop.install()
+    
     # Initialize scraper with your contact information
     # IMPORTANT: Replace with your actual company name and email
     scraper = SECFilingScraper(user_agent="YourCompany contact@yourcompany.com")
@@ -1,25 +1,137 @@
 import json
 import re
 import os
+import string
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import BinaryIO, Dict, List, Optional, Tuple, Union
 from datetime import datetime
 import logging
-from dataclasses import dataclass, asdict
+import multiprocessing
+from dataclasses import dataclass, fields
 import hashlib
+from bisect import bisect_right
+from itertools import accumulate
 
 # HTML parsing
-from bs4 import BeautifulSoup, Comment
+from bs4 import BeautifulSoup, SoupStrainer
+from lxml import etree
 import html
 
 # Text processing
 import unicodedata
 from collections import defaultdict
 
+# orjson writes the processed filings and summary faster when available
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# RE2 matches all section patterns in one linear-time pass when available
+try:
+    import re2
+except ImportError:
+    re2 = None
+
+# Parse-time filter: table extraction builds only <table> subtrees
+TABLE_STRAINER = SoupStrainer('table')
+
+# Size of the blocks a filing is read in while the parser consumes it
+PARSE_BLOCK_SIZE = 256 * 1024
+
+# Elements inside <body> whose text is never part of the filing content
+SKIPPED_TEXT_TAGS = frozenset({'script', 'style'})
+
+# Regexes applied to every filing, sentence and chunk
+BLANK_LINES_RE = re.compile(r'\n\s*\n')
+# Only the runs that change: single spaces would be replaced by themselves
+SPACES_RE = re.compile(r'[ \t]{2,}|\t')
+SENTENCE_SPLIT_RE = re.compile(r'(?<=[.!?])\s+')
+SUBSECTION_RE = re.compile(r'(?i)(?:item\s+\d+[a-z]?\.?)\s*([^.]*)')
+
+# Deletes ASCII letters, so the letter count is the drop in length
+DELETE_LETTERS = str.maketrans('', '', string.ascii_letters)
+
+# Every ITEM/PART section pattern starts with "item" or "part", so one scan for either
+# rules out that whole group of patterns
+STRUCTURAL_SECTION_RE = re.compile(r'(?i)\b(?:item|part)\s')
+
+# Literal words that every noise pattern able to match text with letters contains
+NOISE_TRIGGER_WORDS = ('table', 'page', 'exhibit', 'signature', 'pursuant')
+
+# Common stop words that don't add semantic value to a query
+QUERY_STOP_WORDS = frozenset({
+    'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 
+    'of', 'with', 'by', 'is', 'are', 'was', 'were', 'be', 'been', 'being',
+    'have', 'has', 'had', 'do', 'does', 'did', 'will', 'would', 'could',
+    'should', 'may', 'might', 'can', 'this', 'that', 'these', 'those'
+})
+
+class _QueryCharTable(dict):
+    """
+    str.translate table that lowercases the characters a query may keep (word characters,
+    whitespace and -.,?!) and deletes the rest, filled in as each character is first seen
+    """
+    
+    def __missing__(self, codepoint: int) -> Optional[str]:
+        char = chr(codepoint)
+        if char.isalnum() or char.isspace() or char in '_-.,?!':
+            replacement = char.lower()
+        else:
+            replacement = None
+        self[codepoint] = replacement
+        return replacement
+
+QUERY_TRANSLATE_TABLE = _QueryCharTable()
+
+def _dump_json(obj) -> bytes:
+    """
+    Serialize an object to pretty-printed UTF-8 JSON, with orjson when it is installed
+    
+    Args:
+        obj: Object to serialize
+        
+    Returns:
+        UTF-8 encoded JSON
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, indent=2, ensure_ascii=False).encode('utf-8')
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+class _BodyTextCollector:
+    """
+    lxml parser target that collects the text inside <body> as the parser streams it,
+    so no document tree is ever built
+    """
+    
+    def __init__(self):
+        self.parts = []
+        self.body_depth = 0
+        self.skip_depth = 0
+    
+    def start(self, tag, attrib):
+        if tag == 'body':
+            self.body_depth += 1
+        elif tag in SKIPPED_TEXT_TAGS:
+            self.skip_depth += 1
+    
+    def end(self, tag):
+        if tag == 'body':
+            self.body_depth -= 1
+        elif tag in SKIPPED_TEXT_TAGS:
+            self.skip_depth -= 1
+    
+    def data(self, data):
+        if self.body_depth and not self.skip_depth:
+            self.parts.append(data)
+    
+    def close(self):
+        return ''.join(self.parts)
+
 @dataclass
 class DocumentChunk:
     """Represents a processed document chunk with metadata"""
@@ -38,6 +150,10 @@ class DocumentChunk:
     source_file: str
     page_number: Optional[int] = None
     table_data: Optional[Dict] = None
+
+# DocumentChunk is flat, so its fields can be read directly instead of through asdict's
+# recursive copy
+CHUNK_FIELDS = tuple(field.name for field in fields(DocumentChunk))
     
 class SECTextProcessor:
     """
@@ -136,52 +252,73 @@ class SECTextProcessor:
             'growth_terms': ['year-over-year', 'growth', 'increase', 'decrease', 'compared to'],
             'risk_terms': ['risk factors', 'uncertainty', 'competition', 'regulatory', 'market risk']
         }
+        
+        # Compile the patterns once rather than on every chunk
+        self._compiled_section_patterns = [(name, re.compile(pattern)) for name, pattern in self.section_patterns.items()]
+        self._general_section_patterns = [
+            (name, pattern) for name, pattern in self._compiled_section_patterns
+            if not name.startswith(('ITEM', 'PART'))
+        ]
+        
+        # RE2 set reporting the indices of every matching section pattern
+        self._section_names = list(self.section_patterns)
+        self._section_set = None
+        if re2 is not None:
+            self._section_set = re2.Set.SearchSet()
+            for pattern in self.section_patterns.values():
+                self._section_set.Add(pattern)
+            self._section_set.Compile()
+        self._compiled_noise_patterns = [re.compile(pattern, re.IGNORECASE) for pattern in self.noise_patterns]
     
-    def clean_html(self, html_content: str) -> str:
+    def clean_html(self, html_content: Union[bytes, str, BinaryIO]) -> str:
         """
         Clean HTML content and extract text
         
         Args:
-            html_content: Raw HTML content
+            html_content: Raw HTML content, preferably undecoded bytes or a binary file to
+                read it from block by block
             
         Returns:
             Cleaned text content
         """
-        # Parse HTML
-        soup = BeautifulSoup(html_content, 'html.parser')
-        
-        # Remove unwanted elements
-        for element in soup.find_all(['script', 'style', 'meta', 'link', 'head']):
-            element.decompose()
-        
-        # Remove comments
-        for comment in soup.find_all(string=lambda text: isinstance(text, Comment)):
-            comment.extract()
-        
-        # Convert to text
-        text = soup.get_text()
+        # Stream the HTML through lxml's C parser, decoding raw bytes as UTF-8 like the
+        # filings were always read (left to guess, lxml turns undeclared UTF-8 into mojibake);
+        # the target drops comments, <head>, scripts and styles as it goes
+        parser = etree.HTMLParser(target=_BodyTextCollector(), encoding='utf-8')
+        if hasattr(html_content, 'read'):
+            # Parse each block as it is read, so the whole raw file is never held in memory
+            for block in iter(lambda: html_content.read(PARSE_BLOCK_SIZE), b''):
+                parser.feed(block)
+        else:
+            parser.feed(html_content)
+        text = parser.close()
         
         # Clean up whitespace and special characters
         text = html.unescape(text)
-        text = unicodedata.normalize('NFKD', text)
+        # NFKC folds compatibility characters, notably the &nbsp; and thin spaces SEC HTML
+        # is full of, into plain spaces the whitespace and section patterns match
+        text = unicodedata.normalize('NFKC', text)
         
-        # Remove excessive whitespace
-        text = re.sub(r'\n\s*\n', '\n\n', text)
-        text = re.sub(r'[ \t]+', ' ', text)
-        text = re.sub(r'\n{3,}', '\n\n', text)
+        # Remove excessive whitespace; collapsing blank lines already leaves no run of three
+        # or more newlines
+        text = BLANK_LINES_RE.sub('\n\n', text)
+        text = SPACES_RE.sub(' ', text)
         
         return text.strip()
     
-    def extract_tables(self, soup: BeautifulSoup) -> List[Dict]:
+    def extract_tables(self, soup: Union[BeautifulSoup, bytes, str]) -> List[Dict]:
         """
         Extract and structure table data from HTML
         
         Args:
-            soup: BeautifulSoup object
+            soup: BeautifulSoup object, or raw HTML to parse for its tables only
             
         Returns:
             List of structured table data
         """
+        if not isinstance(soup, BeautifulSoup):
+            soup = BeautifulSoup(soup, 'lxml', parse_only=TABLE_STRAINER)
+        
         tables = []
         
         for i, table in enumerate(soup.find_all('table')):
@@ -231,23 +368,45 @@ class SECTextProcessor:
         Returns:
             Tuple of (section, subsection)
         """
-        text_lower = text.lower()
-        
-        # Check for section patterns
-        for section_name, pattern in self.section_patterns.items():
-            if re.search(pattern, text_lower):
-                # Try to find subsection
-                subsection = None
-                if 'item' in section_name.lower():
-                    # Look for subsection patterns
-                    subsection_match = re.search(r'(?i)(?:item\s+\d+[a-z]?\.?)\s*([^.]*)', text_lower)
-                    if subsection_match:
-                        subsection = subsection_match.group(1).strip()
-                
-                return section_name, subsection
+        section_name = self._match_section(text)
+        if section_name is None:
+            # Default section
+            return 'GENERAL', None
+        
+        # Try to find subsection
+        subsection = None
+        if section_name.startswith('ITEM'):
+            # Look for subsection patterns
+            subsection_match = SUBSECTION_RE.search(text)
+            if subsection_match:
+                subsection = subsection_match.group(1).strip().lower()
+        
+        return section_name, subsection
+    
+    def _match_section(self, text: str) -> Optional[str]:
+        """
+        Find the first section pattern, in declaration order, that matches the text
         
-        # Default section
-        return 'GENERAL', None
+        Args:
+            text: Text content to analyze
+            
+        Returns:
+            Section name, or None if no pattern matches
+        """
+        if self._section_set is not None:
+            matched = self._section_set.Match(text)
+            return self._section_names[min(matched)] if matched else None
+        
+        # Check for section patterns, skipping the ITEM/PART ones when the text can't match them
+        if STRUCTURAL_SECTION_RE.search(text):
+            section_patterns = self._compiled_section_patterns
+        else:
+            section_patterns = self._general_section_patterns
+        
+        for section_name, pattern in section_patterns:
+            if pattern.search(text):
+                return section_name
+        return None
     
     def is_noise_content(self, text: str) -> bool:
         """
@@ -259,21 +418,26 @@ class SECTextProcessor:
         Returns:
             True if text is noise, False otherwise
         """
-        text_lower = text.lower()
-        
-        # Check noise patterns
-        for pattern in self.noise_patterns:
-            if re.search(pattern, text_lower):
-                return True
-        
         # Check for very short content
         if len(text.strip()) < 50:
             return True
         
         # Check for mostly numbers/symbols
-        if len(re.findall(r'[a-zA-Z]', text)) < len(text) * 0.3:
+        letter_count = len(text) - len(text.translate(DELETE_LETTERS))
+        if letter_count < len(text) * 0.3:
             return True
         
+        # Most sentences contain none of the noise words, so check for those in one sweep
+        # before running any pattern
+        text_lower = text.lower()
+        if not any(word in text_lower for word in NOISE_TRIGGER_WORDS):
+            return False
+        
+        # Check noise patterns
+        for pattern in self._compiled_noise_patterns:
+            if pattern.search(text):
+                return True
+        
         return False
     
     def create_chunks(self, text: str, metadata: Dict) -> List[DocumentChunk]:
@@ -289,45 +453,77 @@ class SECTextProcessor:
         """
         chunks = []
         
-        # Split text into sentences first
-        sentences = re.split(r'(?<=[.!?])\s+', text)
+        # Split text into sentences first, skipping noise content
+        sentences = [sentence for sentence in SENTENCE_SPLIT_RE.split(text)
+                     if not self.is_noise_content(sentence)]
+        
+        # offsets[i] is the joined length of the sentences before sentence i, each followed by a space
+        offsets = [0, *accumulate(len(sentence) + 1 for sentence in sentences)]
         
-        current_chunk = ""
+        # Resolve the filing's fields and hash its part of the chunk IDs once for all its chunks
+        document_fields = self._document_fields(metadata)
+        id_hasher = self.chunk_id_hasher(metadata)
+        
+        # The chunk being built spans sentences[start:], and always keeps everything up to
+        # sentences[forced] even when that exceeds the chunk size
+        start = 0
+        forced = 0
         chunk_index = 0
         
-        for sentence in sentences:
-            # Skip noise content
-            if self.is_noise_content(sentence):
-                continue
+        while True:
+            # The chunk ends at the first later sentence that would exceed chunk size, found by
+            # binary search over the offsets rather than by adding sentences one at a time
+            end = bisect_right(offsets, offsets[start] + self.chunk_size + 1) - 1
+            end = max(end, forced + 1)
+            if end >= len(sentences):
+                break
             
-            # Check if adding this sentence would exceed chunk size
-            if len(current_chunk) + len(sentence) > self.chunk_size and current_chunk:
-                # Create chunk
-                chunk = self._create_chunk_object(current_chunk, metadata, chunk_index)
-                chunks.append(chunk)
-                
-                # Start new chunk with overlap
-                overlap_sentences = current_chunk.split('. ')[-2:]  # Last 2 sentences
-                current_chunk = '. '.join(overlap_sentences) + '. ' + sentence
-                chunk_index += 1
-            else:
-                current_chunk += sentence + ' '
+            # Create chunk
+            chunk = self._create_chunk_object(' '.join(sentences[start:end]), document_fields, chunk_index, id_hasher)
+            chunks.append(chunk)
+            
+            # Start new chunk with overlap (last 2 sentences) followed by the sentence that didn't fit
+            start = max(start, end - 2)
+            forced = end
+            chunk_index += 1
         
         # Add final chunk if it meets minimum size
-        if len(current_chunk.strip()) >= self.min_chunk_size:
-            chunk = self._create_chunk_object(current_chunk.strip(), metadata, chunk_index)
+        current_chunk = ' '.join(sentences[start:]).strip()
+        if len(current_chunk) >= self.min_chunk_size:
+            chunk = self._create_chunk_object(current_chunk, document_fields, chunk_index, id_hasher)
             chunks.append(chunk)
         
         return chunks
     
-    def _create_chunk_object(self, text: str, metadata: Dict, chunk_index: int) -> DocumentChunk:
+    def _document_fields(self, metadata: Dict) -> Dict:
+        """
+        Resolve the DocumentChunk fields that every chunk of a document shares
+        
+        Args:
+            metadata: Document metadata
+            
+        Returns:
+            Dictionary of DocumentChunk field values
+        """
+        return {
+            'company': metadata.get('company', 'Unknown'),
+            'form_type': metadata.get('form_type', 'Unknown'),
+            'filing_date': metadata.get('filing_date', 'Unknown'),
+            'report_date': metadata.get('report_date', 'Unknown'),
+            'accession_number': metadata.get('accession_number', 'Unknown'),
+            'source_file': metadata.get('source_file', 'Unknown'),
+        }
+    
+    def _create_chunk_object(self, text: str, document_fields: Dict, chunk_index: int,
+                             id_hasher: hashlib.blake2b) -> DocumentChunk:
         """
         Create a DocumentChunk object from text and metadata
         
         Args:
             text: Chunk text
-            metadata: Document metadata
+            document_fields: Shared fields from _document_fields for this document
             chunk_index: Index of this chunk
+            id_hasher: Hasher from chunk_id_hasher for this document
             
         Returns:
             DocumentChunk object
@@ -336,7 +532,7 @@ class SECTextProcessor:
         section, subsection = self.identify_section(text)
         
         # Generate chunk ID
-        chunk_id = self.generate_chunk_id(metadata, chunk_index)
+        chunk_id = self.generate_chunk_id(id_hasher, chunk_index)
         
         # Count words and characters
         word_count = len(text.split())
@@ -344,34 +540,44 @@ class SECTextProcessor:
         
         return DocumentChunk(
             chunk_id=chunk_id,
-            company=metadata.get('company', 'Unknown'),
-            form_type=metadata.get('form_type', 'Unknown'),
-            filing_date=metadata.get('filing_date', 'Unknown'),
-            report_date=metadata.get('report_date', 'Unknown'),
-            accession_number=metadata.get('accession_number', 'Unknown'),
             section=section,
             subsection=subsection,
             text=text,
             word_count=word_count,
             char_count=char_count,
             chunk_index=chunk_index,
-            source_file=metadata.get('source_file', 'Unknown')
+            **document_fields
         )
     
-    def generate_chunk_id(self, metadata: Dict, chunk_index: int) -> str:
+    def chunk_id_hasher(self, metadata: Dict) -> hashlib.blake2b:
         """
-        Generate a unique chunk ID
+        Start the chunk ID hash with the metadata shared by all chunks of a document
         
         Args:
             metadata: Document metadata
+            
+        Returns:
+            Hasher to pass to generate_chunk_id
+        """
+        hasher = hashlib.blake2b(digest_size=6)
+        hasher.update(f"{metadata.get('company', '')}_{metadata.get('filing_date', '')}_{metadata.get('form_type', '')}_".encode())
+        return hasher
+    
+    def generate_chunk_id(self, id_hasher: hashlib.blake2b, chunk_index: int) -> str:
+        """
+        Generate a unique chunk ID
+        
+        Args:
+            id_hasher: Hasher from chunk_id_hasher for the chunk's document
             chunk_index: Chunk index
             
         Returns:
             Unique chunk ID
         """
-        # Create a hash from metadata and chunk index
-        hash_input = f"{metadata.get('company', '')}_{metadata.get('filing_date', '')}_{metadata.get('form_type', '')}_{chunk_index}"
-        return hashlib.md5(hash_input.encode()).hexdigest()[:12]
+        # Finish a copy of the document hash with the chunk index
+        hasher = id_hasher.copy()
+        hasher.update(str(chunk_index).encode())
+        return hasher.hexdigest()
     
     def extract_metadata_from_filename(self, filename: str) -> Dict:
         """
@@ -439,12 +645,10 @@ class SECTextProcessor:
         try:
             logger.info(f"Processing {file_path.name}")
             
-            # Read HTML content
-            with open(file_path, 'r', encoding='utf-8') as f:
-                html_content = f.read()
-            
-            # Clean HTML and extract text
-            text = self.clean_html(html_content)
+            # Clean HTML and extract text, feeding the raw bytes to the parser as they are read;
+            # the parser decodes them as UTF-8
+            with open(file_path, 'rb') as f:
+                text = self.clean_html(f)
             
             # Extract metadata from filename
             metadata = self.extract_metadata_from_filename(file_path.name)
@@ -453,7 +657,7 @@ class SECTextProcessor:
             chunks = self.create_chunks(text, metadata)
             
             # Convert chunks to dictionaries
-            chunk_dicts = [asdict(chunk) for chunk in chunks]
+            chunk_dicts = [{name: getattr(chunk, name) for name in CHUNK_FIELDS} for chunk in chunks]
             
             # Create output structure
             result = {
@@ -466,9 +670,7 @@ class SECTextProcessor:
             }
             
             # Save to JSON file
-            output_file = self.output_dir / f"{file_path.stem}_processed.json"
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(result, f, indent=2, ensure_ascii=False)
+            self._save_result(result)
             
             logger.info(f"Processed {file_path.name}: {len(chunks)} chunks")
             return result
@@ -481,10 +683,58 @@ class SECTextProcessor:
                 'processing_timestamp': datetime.now().isoformat()
             }
     
-    def process_all_filings(self) -> Dict:
+    def _save_result(self, result: Dict) -> None:
+        """
+        Save a filing's processing result next to the other processed filings
+        
+        Args:
+            result: Result returned by process_single_filing
+        """
+        output_file = self.output_dir / f"{Path(result['filename']).stem}_processed.json"
+        with open(output_file, 'wb') as f:
+            f.write(_dump_json(result))
+    
+    def _drop_duplicate_chunks(self, results: List[Dict]) -> int:
+        """
+        Drop chunks whose text already appeared in an earlier filing of the batch, such as
+        boilerplate repeated across a company's filings, and re-save the filings that lost any
+        
+        Args:
+            results: Processing results, in the order whose first occurrences are kept
+            
+        Returns:
+            Number of duplicate chunks dropped
+        """
+        seen_chunk_hashes = set()
+        dropped = 0
+        
+        for result in results:
+            if 'error' in result:
+                continue
+            
+            unique_chunks = []
+            for chunk in result['chunks']:
+                chunk_hash = hashlib.blake2b(chunk['text'].encode('utf-8'), digest_size=8).digest()
+                if chunk_hash not in seen_chunk_hashes:
+                    seen_chunk_hashes.add(chunk_hash)
+                    unique_chunks.append(chunk)
+            
+            if len(unique_chunks) < len(result['chunks']):
+                dropped += len(result['chunks']) - len(unique_chunks)
+                result['chunks'] = unique_chunks
+                result['total_chunks'] = len(unique_chunks)
+                result['total_words'] = sum(chunk['word_count'] for chunk in unique_chunks)
+                self._save_result(result)
+        
+        return dropped
+    
+    def process_all_filings(self, processes: Optional[int] = None) -> Dict:
         """
         Process all SEC filings in the input directory
         
+        Args:
+            processes: Number of worker processes (defaults to the CPU count)
+            
         Returns:
             Dictionary with processing summary
         """
@@ -499,37 +749,52 @@ class SECTextProcessor:
         
         logger.info(f"Found {len(html_files)} HTML files to process")
         
-        # Process each file
-        results = []
-        successful = 0
-        failed = 0
+        # Process the files in parallel; each worker builds its own processor
+        worker_args = (str(self.input_dir), str(self.output_dir), self.chunk_size,
+                       self.chunk_overlap, self.min_chunk_size)
+        with multiprocessing.Pool(processes=processes or os.cpu_count(),
+                                  initializer=_init_worker, initargs=worker_args) as pool:
+            results = list(pool.imap_unordered(_process_filing_in_worker, html_files, chunksize=4))
         
-        for file_path in html_files:
-            result = self.process_single_filing(file_path)
-            results.append(result)
-            
-            if 'error' in result:
-                failed += 1
-            else:
-                successful += 1
+        # Keep the first occurrence of each chunk in filename order, independent of which
+        # worker finished first
+        results.sort(key=lambda result: result['filename'])
+        duplicate_chunks = self._drop_duplicate_chunks(results)
+        logger.info(f"Dropped {duplicate_chunks} duplicate chunks")
+        
+        failed = sum(1 for result in results if 'error' in result)
+        successful = len(results) - failed
         
         # Create summary
         summary = {
             'total_files': len(html_files),
             'successful': successful,
             'failed': failed,
+            'duplicate_chunks': duplicate_chunks,
             'results': results,
             'processing_timestamp': datetime.now().isoformat()
         }
         
         # Save summary
         summary_file = self.output_dir / "processing_summary.json"
-        with open(summary_file, 'w', encoding='utf-8') as f:
-            json.dump(summary, f, indent=2, ensure_ascii=False)
+        with open(summary_file, 'wb') as f:
+            f.write(_dump_json(summary))
         
         logger.info(f"Processing complete: {successful} successful, {failed} failed")
         return summary
 
+# Processor owned by each worker process of process_all_filings
+_worker_processor: Optional[SECTextProcessor] = None
+
+def _init_worker(*processor_args) -> None:
+    """Build the worker's processor once, since compiled pattern sets don't pickle"""
+    global _worker_processor
+    _worker_processor = SECTextProcessor(*processor_args)
+
+def _process_filing_in_worker(file_path: Path) -> Dict:
+    """Process one filing with the worker's processor"""
+    return _worker_processor.process_single_filing(file_path)
+
 def clean_text_for_query(query: str) -> str:
     """
     Clean and prepare a user query for vector search.
@@ -545,30 +810,19 @@ def clean_text_for_query(query: str) -> str:
         return ""
     
     # Convert to string if needed
-    query = str(query)
-    
-    # Remove extra whitespace
-    query = re.sub(r'\s+', ' ', query.strip())
-    
-    # Remove special characters that might interfere with search
-    query = re.sub(r'[^\w\s\-\.\,\?\!]', '', query)
+    if not isinstance(query, str):
+        query = str(query)
     
-    # Normalize unicode
-    query = unicodedata.normalize('NFKD', query)
+    # Normalize unicode, then strip special characters that might interfere with search and
+    # lowercase for consistency in one translate pass
+    query = unicodedata.normalize('NFKC', query).translate(QUERY_TRANSLATE_TABLE)
     
-    # Convert to lowercase for consistency
-    query = query.lower()
+    # Split on whitespace, which also drops the extra whitespace
+    words = query.split()
+    query = ' '.join(words)
     
     # Remove common stop words that don't add semantic value
-    stop_words = {
-        'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 
-        'of', 'with', 'by', 'is', 'are', 'was', 'were', 'be', 'been', 'being',
-        'have', 'has', 'had', 'do', 'does', 'did', 'will', 'would', 'could',
-        'should', 'may', 'might', 'can', 'this', 'that', 'these', 'those'
-    }
-    
-    words = query.split()
-    filtered_words = [word for word in words if word not in stop_words]
+    filtered_words = [word for word in words if word not in QUERY_STOP_WORDS]
     
     # Reconstruct query
     cleaned_query = ' '.join(filtered_words)
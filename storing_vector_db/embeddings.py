@@ -1,11 +1,27 @@
-from typing import List
+from typing import Dict, Iterable, Iterator, List, Tuple
 import os
+import hashlib
+import random
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
 from pinecone import Pinecone, ServerlessSpec
 from dotenv import load_dotenv
+from cachetools import TTLCache
 from llama_index.embeddings.gemini import GeminiEmbedding
+from google.api_core import exceptions as google_exceptions
 import logging
 
+# ijson streams all_chunks.json instead of loading it whole when available
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
 # Configure logger
 logger = logging.getLogger(__name__)
 
@@ -24,7 +40,137 @@ embed_model = GeminiEmbedding(
     title="this is a document"
 )
 
-def generate_embeddings(text: str) -> List[float]:
+# Embeddings keyed by embedding_cache_key, shared by all callers;
+# TTLCache isn't thread-safe, so concurrent batches go through the lock
+embedding_cache = TTLCache(maxsize=4096, ttl=24 * 3600)
+embedding_cache_lock = threading.Lock()
+
+# Embeddings persisted across runs, so unchanged texts are never re-embedded
+EMBEDDING_STORE_PATH = os.getenv("EMBEDDING_STORE_PATH", os.path.join(".cache", "embeddings.sqlite3"))
+
+
+class PersistentEmbeddingCache:
+    """
+    SQLite store of embeddings keyed by embedding_cache_key, shared by the
+    threads of the process. The database is opened on first use.
+    """
+    
+    def __init__(self, path: str = EMBEDDING_STORE_PATH):
+        """Initialize the store without touching the disk"""
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+    
+    def _connection(self) -> sqlite3.Connection:
+        """Open the database and create its table on first use; call with the lock held"""
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            # Vectors are float32 bytes; the float64 rows of older stores' "embeddings" table are left unread
+            self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings_float32 (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+        return self._conn
+    
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """Return the stored embeddings among the given keys"""
+        found = {}
+        try:
+            with self._lock:
+                conn = self._connection()
+                # Stay under SQLite's bound-parameter limit
+                for start in range(0, len(keys), 500):
+                    batch_keys = keys[start:start + 500]
+                    rows = conn.execute(
+                        f"SELECT key, vector FROM embeddings_float32 WHERE key IN ({','.join('?' * len(batch_keys))})",
+                        batch_keys
+                    )
+                    for key, vector in rows:
+                        found[key] = np.frombuffer(vector, dtype=np.float32)
+        except sqlite3.Error as e:
+            logger.warning(f"Embedding store read failed: {e}")
+        return found
+    
+    def set_many(self, embeddings: Dict[str, np.ndarray]):
+        """Store embeddings under their keys"""
+        try:
+            with self._lock:
+                conn = self._connection()
+                with conn:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO embeddings_float32 (key, vector) VALUES (?, ?)",
+                        [(key, np.asarray(embedding, dtype=np.float32).tobytes()) for key, embedding in embeddings.items()]
+                    )
+        except sqlite3.Error as e:
+            logger.warning(f"Embedding store write failed: {e}")
+
+
+persistent_embedding_cache = PersistentEmbeddingCache()
+
+# SEC archive URL of a filing document, and each accession number seen with its dashes
+# removed; a filing's chunks all share one accession number
+SEC_ARCHIVE_URL = "https://www.sec.gov/Archives/edgar/data/{}/{}/{}"
+_accession_paths: Dict[str, str] = {}
+
+def build_sec_url(company, accession_number, source_file):
+    # This is a placeholder. For real SEC URLs, you need the CIK and accession number without dashes.
+    # Example: https://www.sec.gov/Archives/edgar/data/{CIK}/{accession_number_no_dashes}/{filename}
+    # If you have CIK mapping, use it. Otherwise, use accession_number and file as best effort.
+    if accession_number and source_file:
+        acc_no = _accession_paths.get(accession_number)
+        if acc_no is None:
+            acc_no = _accession_paths[accession_number] = accession_number.replace('-', '')
+        return SEC_ARCHIVE_URL.format(company, acc_no, source_file)
+    return ""
+
+def embedding_cache_key(text: str) -> str:
+    """Build the cache key for a text embedded by the configured model"""
+    return hashlib.blake2b(f"{GEMINI_MODEL_NAME}\0{text}".encode("utf-8"), digest_size=16).hexdigest()
+
+# Texts per Gemini embedding request, and a cap on their approximate token count
+# (~4 characters per token) so one request stays a small share of the per-minute quota
+EMBED_BATCH_SIZE = 100
+EMBED_BATCH_MAX_TOKENS = 20000
+
+# Embedding requests in flight at once, and transient error handling for them
+EMBED_MAX_WORKERS = 5
+MAX_EMBED_RETRIES = 4
+RETRY_BASE_DELAY = 1.0
+RETRYABLE_EMBED_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError
+)
+
+# Spreadsheet columns load_and_upload_data reads
+REQUIRED_COLUMNS = frozenset({'Type', 'Question', 'Answer'})
+
+# Chunk fields copied unchanged into each record's Pinecone metadata
+CHUNK_METADATA_KEYS = (
+    "company", "form_type", "filing_date", "report_date",
+    "accession_number", "section", "subsection", "source_file"
+)
+
+# Largest chunk text uploaded, in bytes, for safety under the 36,000 byte API limit
+MAX_CHUNK_SIZE = 35000
+
+# Pinecone upsert requests in flight at once; the next batch is sent while earlier ones
+# are still on the wire instead of waiting out each round trip
+UPSERT_WINDOW = 8
+
+# Upsert batches are packed up to this many estimated bytes, leaving headroom under
+# Pinecone's 2MB request limit, and upsert_records takes at most 96 records per request
+UPSERT_MAX_BYTES = 1_500_000
+UPSERT_RECORDS_MAX_COUNT = 96
+
+# Pinecone namespace holding every chunk record; queries narrow it with metadata filters
+CHUNK_NAMESPACE = "mag7-financial-data"
+
+def _retry_delay(attempt: int) -> float:
+    """Exponential backoff with jitter for the given retry attempt"""
+    return RETRY_BASE_DELAY * 2 ** attempt + random.uniform(0, RETRY_BASE_DELAY)
+
+def generate_embeddings(text: str) -> np.ndarray:
     """
     Generate embeddings for the input text using Gemini's embedding model.
     
@@ -32,10 +178,123 @@ def generate_embeddings(text: str) -> List[float]:
         text: The text to generate embeddings for
         
     Returns:
-        List of embedding values
+        float32 array of embedding values
     """
-    text = text.replace("\n", " ")  # Remove newline characters for clean input
-    return embed_model.get_text_embedding(text)
+    return generate_embeddings_batch([text])[0]
+
+def iter_embedding_batches(texts: List[str]) -> Iterator[Tuple[int, List[str]]]:
+    """
+    Split texts into embedding requests bounded by EMBED_BATCH_SIZE texts and
+    EMBED_BATCH_MAX_TOKENS approximate tokens.
+    
+    Args:
+        texts: Texts to embed
+        
+    Yields:
+        Tuples of (index of the batch's first text, batch texts)
+    """
+    start = 0
+    batch_tokens = 0
+    for i, text in enumerate(texts):
+        text_tokens = len(text) // 4 + 1
+        if i > start and (i - start >= EMBED_BATCH_SIZE or batch_tokens + text_tokens > EMBED_BATCH_MAX_TOKENS):
+            yield start, texts[start:i]
+            start = i
+            batch_tokens = 0
+        batch_tokens += text_tokens
+    if start < len(texts):
+        yield start, texts[start:]
+
+def generate_embeddings_batch(texts: List[str]) -> np.ndarray:
+    """
+    Generate embeddings for several texts, checking the in-memory and persistent
+    caches first and sending the remaining texts to Gemini in a single request.
+    
+    Args:
+        texts: The texts to generate embeddings for
+        
+    Returns:
+        float32 array of shape (len(texts), dimension), in the order of the texts
+    """
+    texts = [text.replace("\n", " ") for text in texts]
+    cache_keys = [embedding_cache_key(text) for text in texts]
+    with embedding_cache_lock:
+        embeddings = [embedding_cache.get(cache_key) for cache_key in cache_keys]
+    
+    # Fall back to the embeddings stored by earlier runs
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    if missing:
+        stored = persistent_embedding_cache.get_many([cache_keys[i] for i in missing])
+        with embedding_cache_lock:
+            for i in missing:
+                embedding = stored.get(cache_keys[i])
+                if embedding is not None:
+                    embeddings[i] = embedding
+                    embedding_cache[cache_keys[i]] = embedding
+        missing = [i for i in missing if embeddings[i] is None]
+    
+    if missing:
+        # Gemini returns lists of Python floats; cache them as compact float32 rows
+        new_embeddings = np.asarray(
+            embed_model.get_text_embedding_batch([texts[i] for i in missing], show_progress=False),
+            dtype=np.float32
+        )
+        with embedding_cache_lock:
+            for i, embedding in zip(missing, new_embeddings):
+                embeddings[i] = embedding
+                embedding_cache[cache_keys[i]] = embedding
+        persistent_embedding_cache.set_many({cache_keys[i]: embeddings[i] for i in missing})
+    return np.stack(embeddings)
+
+def _embed_batch_with_retry(texts: List[str], max_retries: int = MAX_EMBED_RETRIES) -> np.ndarray:
+    """
+    Embed one batch, retrying rate limits and transient API errors with backoff.
+    
+    Args:
+        texts: Batch texts
+        max_retries: Retries before the error is raised
+        
+    Returns:
+        float32 array of embeddings, in the order of the texts
+    """
+    # Stagger batch starts so the workers don't hit the API in lockstep
+    time.sleep(random.uniform(0, RETRY_BASE_DELAY / 4))
+    for attempt in range(max_retries + 1):
+        try:
+            return generate_embeddings_batch(texts)
+        except RETRYABLE_EMBED_ERRORS as e:
+            if attempt == max_retries:
+                raise
+            delay = _retry_delay(attempt)
+            logger.warning(f"Embedding batch failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+def embed_texts(texts: List[str], max_workers: int = EMBED_MAX_WORKERS) -> np.ndarray:
+    """
+    Embed any number of texts, keeping up to max_workers batch requests in flight.
+    
+    Args:
+        texts: Texts to embed
+        max_workers: Batch requests to run concurrently
+        
+    Returns:
+        float32 array of shape (len(texts), dimension), in the order of the texts
+    """
+    # Batches are written into one preallocated float32 array, sized by the first batch
+    embeddings = np.empty((len(texts), 0), dtype=np.float32)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(_embed_batch_with_retry, batch_texts): start
+            for start, batch_texts in iter_embedding_batches(texts)
+        }
+        for done, future in enumerate(futures, 1):
+            start = futures[future]
+            batch_embeddings = future.result()
+            if done == 1:
+                embeddings = np.empty((len(texts), batch_embeddings.shape[1]), dtype=np.float32)
+            embeddings[start:start + len(batch_embeddings)] = batch_embeddings
+            logger.info(f"Generated embeddings: batch {done}/{len(futures)}")
+    return embeddings
 
 def create_pinecone_index(index_name: str, dimension: int = 768):
     """
@@ -51,15 +310,15 @@ def create_pinecone_index(index_name: str, dimension: int = 768):
     pc_client = Pinecone(api_key=PINECONE_API_KEY)
     
     try:
-        # List existing indexes to test connection
-        existing_indexes = [index.name for index in pc_client.list_indexes()]
-        logger.info(f"Successfully connected to Pinecone. Found {len(existing_indexes)} indexes")
+        # Check this one index rather than listing every index
+        index_exists = pc_client.has_index(index_name)
+        logger.info("Successfully connected to Pinecone")
     except Exception as e:
         logger.error(f"Failed to connect to Pinecone: {e}")
         raise
     
     # Check if index exists
-    if index_name not in existing_indexes:
+    if not index_exists:
         logger.info(f"Creating new Pinecone index with integrated embeddings: {index_name}")
         pc_client.create_index_for_model(
             name=index_name,
@@ -74,7 +333,48 @@ def create_pinecone_index(index_name: str, dimension: int = 768):
     else:
         logger.info(f"Using existing Pinecone index: {index_name}")
     
-    return pc_client.Index(index_name)
+    # One pool thread per in-flight async_req upsert
+    return pc_client.Index(index_name, pool_threads=UPSERT_WINDOW)
+
+def estimate_record_bytes(record: Dict) -> int:
+    """Rough serialized size of a Pinecone record: string lengths plus ~20 bytes per number"""
+    size = 0
+    for key, value in record.items():
+        size += len(key) + 4
+        if isinstance(value, str):
+            size += len(value) + 2
+        elif isinstance(value, dict):
+            size += estimate_record_bytes(value)
+        elif isinstance(value, (list, tuple, np.ndarray)):
+            size += 20 * len(value)
+        else:
+            size += 20
+    return size
+
+def pack_batches(records: Iterable[Dict], max_count: int, max_bytes: int = UPSERT_MAX_BYTES) -> Iterator[List[Dict]]:
+    """
+    Greedily pack records into upsert batches bounded by count and estimated size.
+    
+    Args:
+        records: Records to upload
+        max_count: Most records in one batch
+        max_bytes: Most estimated bytes in one batch
+        
+    Yields:
+        Batches of records
+    """
+    batch = []
+    batch_bytes = 0
+    for record in records:
+        record_bytes = estimate_record_bytes(record)
+        if batch and (len(batch) >= max_count or batch_bytes + record_bytes > max_bytes):
+            yield batch
+            batch = []
+            batch_bytes = 0
+        batch.append(record)
+        batch_bytes += record_bytes
+    if batch:
+        yield batch
 
 def load_and_upload_data(xlsx_path: str, index_name: str, batch_size: int = 100, dimension: int = 768):
     """
@@ -98,50 +398,61 @@ def load_and_upload_data(xlsx_path: str, index_name: str, batch_size: int = 100,
     logger.info("Index creation/check completed.")
     
     try:
-        sheets = pd.read_excel(xlsx_path, sheet_name=None)
-        logger.info(f"Excel file loaded successfully with {len(sheets)} sheets")
+        # Parse one sheet at a time, reading only the needed columns with their usual types
+        workbook = pd.ExcelFile(xlsx_path)
+        logger.info(f"Excel file opened successfully with {len(workbook.sheet_names)} sheets")
         
         all_data = []
-        for sheet_name, data in sheets.items():
+        for sheet_name in workbook.sheet_names:
+            data = workbook.parse(sheet_name, usecols=lambda column: column in REQUIRED_COLUMNS)
             logger.info(f"Processing sheet: {sheet_name} with {len(data)} rows")
-            for row_index, row in data.iterrows():
-                # Check if the required columns exist
-                if all(col in row.index for col in ['Type', 'Question', 'Answer']):
-                    # Combine Question and Answer for embedding
-                    combined_text = f"Type: {row['Type']}\nQuestion: {row['Question']}\nAnswer: {row['Answer']}"
-                    
-                    all_data.append({
-                        "id": f"{sheet_name}-{row_index}",
-                        "metadata": {
-                            "type": row["Type"],
-                            "question": row["Question"],
-                            "answer": row["Answer"],
-                            "sheet_name": sheet_name
-                        },
-                        "text": combined_text
-                    })
-                else:
-                    logger.warning(f"Row {row_index} in sheet '{sheet_name}' is missing required columns")
+            
+            # Check once per sheet that the required columns exist
+            if not REQUIRED_COLUMNS.issubset(data.columns):
+                logger.warning(f"Sheet '{sheet_name}' is missing required columns; skipping its {len(data)} rows")
+                continue
+            
+            # Read each column once as plain Python values instead of building a Series per row
+            rows = zip(data.index.tolist(), data['Type'].tolist(), data['Question'].tolist(), data['Answer'].tolist())
+            for row_index, row_type, question, answer in rows:
+                # Combine Question and Answer for embedding
+                combined_text = f"Type: {row_type}\nQuestion: {question}\nAnswer: {answer}"
+                
+                all_data.append({
+                    "id": f"{sheet_name}-{row_index}",
+                    "metadata": {
+                        "type": row_type,
+                        "question": question,
+                        "answer": answer,
+                        "sheet_name": sheet_name
+                    },
+                    "text": combined_text
+                })
         
         logger.info(f"Total data points to embed: {len(all_data)}")
         
-        embeddings_list = []
-        for i, doc in enumerate(all_data):
-            if i % 10 == 0:
-                logger.info(f"Generating embeddings: {i}/{len(all_data)}")
-            
-            embedding = generate_embeddings(doc["text"])
-            embeddings_list.append({
+        logger.info(f"Generating embeddings for {len(all_data)} data points")
+        embeddings = embed_texts([doc["text"] for doc in all_data])
+        embeddings_list = [
+            {
                 "id": doc["id"],
                 "values": embedding,
                 "metadata": doc["metadata"]
-            })
+            }
+            for doc, embedding in zip(all_data, embeddings)
+        ]
         
-        # Upload in batches
-        for i in range(0, len(embeddings_list), batch_size):
-            batch = embeddings_list[i:i + batch_size]
-            logger.info(f"Uploading batch {i//batch_size + 1}/{(len(embeddings_list) + batch_size - 1)//batch_size}")
-            index.upsert(vectors=batch)
+        # Upload in size-bounded batches, keeping up to UPSERT_WINDOW requests in flight
+        in_flight = deque()
+        for batch_number, batch in enumerate(pack_batches(embeddings_list, batch_size), 1):
+            logger.info(f"Uploading batch {batch_number} ({len(batch)} records)")
+            if len(in_flight) >= UPSERT_WINDOW:
+                in_flight.popleft().get()
+            # Embeddings stay float32 rows until here; the SDK takes plain lists
+            vectors = [dict(record, values=record["values"].tolist()) for record in batch]
+            in_flight.append(index.upsert(vectors=vectors, async_req=True))
+        while in_flight:
+            in_flight.popleft().get()
         
         logger.info(f"Successfully uploaded {len(embeddings_list)} records to Pinecone index {index_name}")
         return {"message": f"Successfully uploaded {len(embeddings_list)} records to the Pinecone index."}
@@ -150,6 +461,51 @@ def load_and_upload_data(xlsx_path: str, index_name: str, batch_size: int = 100,
         logger.error(f"Error processing file {xlsx_path}: {str(e)}")
         raise
 
+def prepare_records(chunks: Iterable[Dict]) -> Iterator[Dict]:
+    """
+    Turn processed chunks into Pinecone records for integrated embedding upsert,
+    one at a time, skipping chunks over the API size limit.
+    
+    Args:
+        chunks: Chunk dictionaries, as written to all_chunks.json
+        
+    Yields:
+        Record with the raw chunk text and its metadata
+    """
+    for i, chunk in enumerate(chunks):
+        text = chunk["text"]
+        # UTF-8 takes at most 4 bytes per character, so only texts that could be too large get encoded
+        if len(text) * 4 > MAX_CHUNK_SIZE:
+            text_bytes = len(text.encode("utf-8"))
+            if text_bytes > MAX_CHUNK_SIZE:
+                logger.warning(f"Skipping chunk {chunk.get('chunk_id', 'unknown')} from {chunk.get('source_file', 'unknown')} - too large ({text_bytes} bytes)")
+                continue
+        
+        # Create structured ID
+        chunk_id = chunk.get("chunk_id", f"chunk_{i}")
+        
+        # Prepare metadata: the copied fields are looked up once, and the derived ones reuse them
+        metadata = {key: chunk.get(key) for key in CHUNK_METADATA_KEYS}
+        metadata.update({
+            "document_id": chunk.get("company", "unknown"),
+            "document_title": f"{chunk.get('company', 'Unknown')} {chunk.get('form_type', 'Filing')}",
+            "chunk_number": chunk.get("chunk_index", i),
+            "document_url": build_sec_url(
+                metadata["company"], 
+                metadata["accession_number"], 
+                metadata["source_file"]
+            ),
+            "created_at": chunk.get("filing_date", "unknown"),
+            "document_type": "sec_filing"
+        })
+        
+        # Yield the record with raw text (Pinecone will convert to vector)
+        yield {
+            "_id": chunk_id,
+            "chunk_text": text,  # This field will be converted to vector by Pinecone
+            **metadata
+        }
+
 def load_and_upload_all_chunks(json_path: str, index_name: str, batch_size: int = 100, dimension: int = 768):
     """
     Load all chunks from all_chunks.json and upload to Pinecone using integrated embeddings.
@@ -173,72 +529,49 @@ def load_and_upload_all_chunks(json_path: str, index_name: str, batch_size: int
     index = create_pinecone_index(index_name, dimension)
     logger.info("Index creation/check completed.")
 
-    with open(json_path, "r", encoding="utf-8") as f:
-        all_chunks = json.load(f)
-
-    logger.info(f"Loaded {len(all_chunks)} chunks from {json_path}")
+    with open(json_path, "rb") as f:
+        # Stream chunks one at a time when ijson is installed, so preparing and uploading
+        # overlap with parsing and memory holds a few batches instead of the whole file
+        if ijson is not None:
+            all_chunks = ijson.items(f, "item", use_float=True)
+        else:
+            all_chunks = json.load(f)
 
-    # Prepare records for integrated embedding upsert
-    records = []
-    MAX_CHUNK_SIZE = 35000  # bytes, for safety under 36,000 byte API limit
-    
-    for i, chunk in enumerate(tqdm(all_chunks, desc="Preparing chunks")):
-        text = chunk["text"]
-        if len(text.encode("utf-8")) > MAX_CHUNK_SIZE:
-            logger.warning(f"Skipping chunk {chunk.get('chunk_id', 'unknown')} from {chunk.get('source_file', 'unknown')} - too large ({len(text.encode('utf-8'))} bytes)")
-            continue
-        
-        # Create structured ID
-        chunk_id = chunk.get("chunk_id", f"chunk_{i}")
+        # Prepare records for integrated embedding upsert as the chunks stream in, and upload
+        # each batch as soon as it fills. upsert_records has no async_req, so a thread pool
+        # keeps up to UPSERT_WINDOW requests in flight
+        records = prepare_records(tqdm(all_chunks, desc="Preparing chunks"))
+        total_records = 0
+        in_flight = deque()
         
-        # Prepare metadata
-        metadata = {
-            "document_id": chunk.get("company", "unknown"),
-            "document_title": f"{chunk.get('company', 'Unknown')} {chunk.get('form_type', 'Filing')}",
-            "chunk_number": chunk.get("chunk_index", i),
-            "document_url": build_sec_url(
-                chunk.get("company"), 
-                chunk.get("accession_number"), 
-                chunk.get("source_file")
-            ),
-            "created_at": chunk.get("filing_date", "unknown"),
-            "document_type": "sec_filing",
-            "company": chunk.get("company"),
-            "form_type": chunk.get("form_type"),
-            "filing_date": chunk.get("filing_date"),
-            "report_date": chunk.get("report_date"),
-            "accession_number": chunk.get("accession_number"),
-            "section": chunk.get("section"),
-            "subsection": chunk.get("subsection"),
-            "source_file": chunk.get("source_file")
-        }
+        def wait_for_oldest_batch():
+            finished_batch, future = in_flight.popleft()
+            try:
+                future.result()
+                logger.info(f"✅ Successfully uploaded batch {finished_batch}")
+            except Exception as e:
+                logger.error(f"❌ Failed to upload batch {finished_batch}: {e}")
+                raise
         
-        # Add the record with raw text (Pinecone will convert to vector)
-        records.append({
-            "_id": chunk_id,
-            "chunk_text": text,  # This field will be converted to vector by Pinecone
-            **metadata
-        })
+        with ThreadPoolExecutor(max_workers=UPSERT_WINDOW) as executor:
+            batches = pack_batches(records, min(batch_size, UPSERT_RECORDS_MAX_COUNT))
+            for batch_number, batch in enumerate(batches, 1):
+                logger.info(f"Uploading batch {batch_number}")
+                
+                if len(in_flight) >= UPSERT_WINDOW:
+                    wait_for_oldest_batch()
+                future = executor.submit(
+                    index.upsert_records,
+                    namespace=CHUNK_NAMESPACE,
+                    records=batch
+                )
+                in_flight.append((batch_number, future))
+                total_records += len(batch)
+            while in_flight:
+                wait_for_oldest_batch()
 
-    logger.info(f"Prepared {len(records)} records for upload")
-
-    # Upload in batches using integrated embeddings
-    for i in range(0, len(records), batch_size):
-        batch = records[i:i + batch_size]
-        logger.info(f"Uploading batch {i//batch_size + 1}/{(len(records) + batch_size - 1)//batch_size}")
-        
-        try:
-            index.upsert_records(
-                namespace="mag7-financial-data",
-                records=batch
-            )
-            logger.info(f"✅ Successfully uploaded batch {i//batch_size + 1}")
-        except Exception as e:
-            logger.error(f"❌ Failed to upload batch {i//batch_size + 1}: {e}")
-            raise
-
-    logger.info(f"Successfully uploaded {len(records)} records to Pinecone index {index_name}")
-    return {"message": f"Successfully uploaded {len(records)} records to the Pinecone index using integrated embeddings."}
+    logger.info(f"Successfully uploaded {total_records} records to Pinecone index {index_name}")
+    return {"message": f"Successfully uploaded {total_records} records to the Pinecone index using integrated embeddings."}
 
 # Example usage:
 if __name__ == "__main__":
@@ -1,14 +1,23 @@
 import os
 import sys
+import asyncio
 # Add project root to sys.path for direct script execution
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from pinecone import Pinecone
+from pinecone import Pinecone, PineconeAsyncio
 from dotenv import load_dotenv
-from storing_vector_db.embeddings import generate_embeddings
+from storing_vector_db.embeddings import generate_embeddings, build_sec_url, CHUNK_NAMESPACE
 import logging
 import google.generativeai as genai
 import json
+import re
+import heapq
+import hashlib
+import pickle
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from rank_bm25 import BM25Okapi
 
 # Configure logger
 logger = logging.getLogger(__name__)
@@ -16,37 +25,109 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
-# Explicitly set environment variables to ensure they're loaded
-os.environ["GOOGLE_API_KEY"] = os.getenv("GOOGLE_API_KEY", "")
-os.environ["PINECONE_API_KEY"] = os.getenv("PINECONE_API_KEY", "")
-os.environ["PINECONE_INDEX_NAME"] = os.getenv("PINECONE_INDEX_NAME", "mag7-financial-intelligence-2025")
-
-# Debug: Print API key status for retrieval module
-print("🔍 Retrieval Module - API Key Debug:")
-pinecone_key = os.environ["PINECONE_API_KEY"]
-google_key = os.environ["GOOGLE_API_KEY"]
-print(f"PINECONE_API_KEY: {'✅ Set' if pinecone_key else '❌ Not set'}")
-print(f"GOOGLE_API_KEY: {'✅ Set' if google_key else '❌ Not set'}")
-
-if pinecone_key:
-    print(f"PINECONE_API_KEY (first 10 chars): {pinecone_key[:10]}...")
-if google_key:
-    print(f"GOOGLE_API_KEY (first 10 chars): {google_key[:10]}...")
-
-# Check if .env file exists from this location
-env_file_path = os.path.join(os.path.dirname(__file__), '..', '.env')
-print(f".env file exists: {'✅ Yes' if os.path.exists(env_file_path) else '❌ No'}")
-print(f".env file path: {env_file_path}")
-print("=" * 50)
-
-def build_sec_url(company, accession_number, source_file):
-    # This is a placeholder. For real SEC URLs, you need the CIK and accession number without dashes.
-    # Example: https://www.sec.gov/Archives/edgar/data/{CIK}/{accession_number_no_dashes}/{filename}
-    # If you have CIK mapping, use it. Otherwise, use accession_number and file as best effort.
-    if accession_number and source_file:
-        acc_no = accession_number.replace('-', '')
-        return f"https://www.sec.gov/Archives/edgar/data/{company}/{acc_no}/{source_file}"
-    return ""
+# Make sure the variables exist, since this module reads os.environ directly
+os.environ.setdefault("GOOGLE_API_KEY", "")
+os.environ.setdefault("PINECONE_API_KEY", "")
+os.environ.setdefault("PINECONE_INDEX_NAME", "mag7-financial-intelligence-2025")
+
+def _log_env_debug():
+    """Log API key and .env status without revealing the keys."""
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    env_file_path = os.path.join(os.path.dirname(__file__), '..', '.env')
+    logger.debug(f"PINECONE_API_KEY: {'set' if os.environ['PINECONE_API_KEY'] else 'not set'}")
+    logger.debug(f"GOOGLE_API_KEY: {'set' if os.environ['GOOGLE_API_KEY'] else 'not set'}")
+    logger.debug(f".env file exists: {'yes' if os.path.exists(env_file_path) else 'no'} ({env_file_path})")
+
+@lru_cache(maxsize=None)
+def get_pinecone_index(index_name: str):
+    """
+    Get a Pinecone index handle, creating the client once per process so
+    its HTTP connection pool is reused across queries.
+
+    Args:
+        index_name: Name of the Pinecone index.
+
+    Returns:
+        Pinecone index object
+    """
+    pc_client = Pinecone(api_key=os.environ["PINECONE_API_KEY"])
+    return pc_client.Index(index_name)
+
+@lru_cache(maxsize=None)
+def get_generative_model(model_name: str):
+    """
+    Get a Gemini model handle, configuring the API key once per process
+    rather than on every answer.
+
+    Args:
+        model_name: Name of the Gemini model.
+
+    Returns:
+        GenerativeModel object
+    """
+    genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
+    return genai.GenerativeModel(model_name)
+
+# Asyncio index handles keyed by index name, and the clients that own them; the lock
+# makes concurrent first queries for an index create a single client
+_async_indexes = {}
+_async_clients = []
+_async_index_lock = asyncio.Lock()
+
+async def get_async_pinecone_index(index_name: str):
+    """
+    Get an asyncio Pinecone index handle, created once per process so
+    concurrent queries share one session instead of blocking the event loop.
+
+    Args:
+        index_name: Name of the Pinecone index.
+
+    Returns:
+        IndexAsyncio object
+    """
+    index = _async_indexes.get(index_name)
+    if index is None:
+        async with _async_index_lock:
+            index = _async_indexes.get(index_name)
+            if index is None:
+                pc_client = PineconeAsyncio(api_key=os.environ["PINECONE_API_KEY"])
+                _async_clients.append(pc_client)
+                description = await pc_client.describe_index(index_name)
+                index = pc_client.IndexAsyncio(host=description.host)
+                _async_indexes[index_name] = index
+    return index
+
+async def warmup_pinecone_async(index_name: str = "mag7-financial-intelligence-2025"):
+    """
+    Open the asyncio client's connection to a Pinecone index ahead of the
+    first query, on the event loop that will serve the queries.
+
+    Args:
+        index_name: Name of the Pinecone index.
+    """
+    index = await get_async_pinecone_index(index_name)
+    await index.describe_index_stats()
+
+async def close_async_pinecone():
+    """Close the asyncio index handles and their clients' sessions, on the loop that used them."""
+    indexes = list(_async_indexes.values())
+    clients = list(_async_clients)
+    _async_indexes.clear()
+    _async_clients.clear()
+    for index in indexes:
+        await index.close()
+    for pc_client in clients:
+        await pc_client.close()
+
+def warmup_pinecone(index_name: str = "mag7-financial-intelligence-2025"):
+    """
+    Open the connection to a Pinecone index ahead of the first query.
+
+    Args:
+        index_name: Name of the Pinecone index.
+    """
+    get_pinecone_index(index_name).describe_index_stats()
 
 def query_pinecone(query: str, index_name: str, top_k: int = 5, filter_dict: dict = None):
     """
@@ -62,12 +143,11 @@ def query_pinecone(query: str, index_name: str, top_k: int = 5, filter_dict: dic
         List of dicts with chunk text, metadata, and similarity score.
     """
     # Connect to Pinecone index
-    pc_client = Pinecone(api_key=os.environ["PINECONE_API_KEY"])
-    index = pc_client.Index(index_name)
+    index = get_pinecone_index(index_name)
 
     # Query Pinecone using integrated embeddings (search with raw text)
     response = index.search(
-        namespace="mag7-financial-data",
+        namespace=CHUNK_NAMESPACE,
         query={
             "inputs": {"text": query},
             "top_k": top_k,
@@ -75,8 +155,44 @@ def query_pinecone(query: str, index_name: str, top_k: int = 5, filter_dict: dic
         },
         fields=["chunk_text"]
     )
+    return format_matches(response)
+
+async def query_pinecone_async(query: str, index_name: str, top_k: int = 5, filter_dict: dict = None):
+    """
+    Query Pinecone like query_pinecone, but through the asyncio client so
+    the event loop keeps serving other requests during the round-trip.
+
+    Args:
+        query: User's question.
+        index_name: Name of the Pinecone index.
+        top_k: Number of results to return.
+        filter_dict: Optional Pinecone metadata filter.
 
-    # Format results
+    Returns:
+        List of dicts with chunk text, metadata, and similarity score.
+    """
+    index = await get_async_pinecone_index(index_name)
+    response = await index.search(
+        namespace=CHUNK_NAMESPACE,
+        query={
+            "inputs": {"text": query},
+            "top_k": top_k,
+            "filter": filter_dict
+        },
+        fields=["chunk_text"]
+    )
+    return format_matches(response)
+
+def format_matches(response):
+    """
+    Flatten a Pinecone search response into result dicts.
+
+    Args:
+        response: Pinecone search response.
+
+    Returns:
+        List of dicts with chunk text, metadata, and similarity score.
+    """
     results = []
     for match in response['matches']:
         metadata = match['metadata']
@@ -96,7 +212,7 @@ def query_pinecone(query: str, index_name: str, top_k: int = 5, filter_dict: dic
         })
     return results
 
-async def get_relevant_chunks(query: str, top_k: int = 8, index_name: str = "mag7-financial-intelligence-2025"):
+async def get_relevant_chunks(query: str, top_k: int = 8, index_name: str = "mag7-financial-intelligence-2025", max_content_chars: int = None):
     """
     Get relevant chunks from the vector database for a given query.
     This is a wrapper function that provides the interface expected by the conversational agent.
@@ -105,22 +221,28 @@ async def get_relevant_chunks(query: str, top_k: int = 8, index_name: str = "mag
         query: The search query
         top_k: Number of chunks to retrieve
         index_name: Name of the Pinecone index
+        max_content_chars: Optional limit on the length of each chunk's content
         
     Returns:
         List of dictionaries containing chunk information
     """
     try:
-        # Use the existing query_pinecone function
-        results = query_pinecone(query, index_name, top_k=top_k)
+        # Query through the asyncio client so concurrent callers overlap
+        # their Pinecone round-trips
+        results = await query_pinecone_async(query, index_name, top_k=top_k)
         
         # Transform results to match the expected format
         chunks = []
         for result in results:
+            content = result.get('text', '')
+            if max_content_chars is not None and len(content) > max_content_chars:
+                content = content[:max_content_chars]
+            
             chunk = {
                 'company': result.get('company', 'Unknown'),
                 'filing_type': result.get('form_type', 'Unknown'),
                 'period': result.get('filing_date', 'Unknown'),
-                'content': result.get('text', ''),
+                'content': content,
                 'url': build_sec_url(
                     result.get('company'), 
                     result.get('accession_number'), 
@@ -137,19 +259,78 @@ async def get_relevant_chunks(query: str, top_k: int = 8, index_name: str = "mag
         logger.error(f"Error retrieving chunks: {e}")
         return []
 
-# --- BM25 Hybrid Search (Stub) ---
-def bm25_search(query: str, corpus: list, top_k: int = 5):
+# --- BM25 Hybrid Search ---
+BM25_TOKEN_RE = re.compile(r"\w+")
+
+# Key of the last corpus indexed by bm25_search and its BM25 index
+_bm25_corpus_key = None
+_bm25_index = None
+
+def tokenize_for_bm25(text: str):
+    """Split text into lowercase word tokens for BM25."""
+    return BM25_TOKEN_RE.findall(text.lower())
+
+def corpus_fingerprint(corpus: list) -> str:
+    """Content hash of a corpus's texts, saved with a cached BM25 index."""
+    digest = hashlib.blake2b(digest_size=16)
+    for chunk in corpus:
+        digest.update(chunk.get("text", "").encode('utf-8'))
+        digest.update(b"\0")
+    return f"{len(corpus)}:{digest.hexdigest()}"
+
+def build_bm25_index(corpus: list, cache_path: str = None):
     """
-    Placeholder for BM25 search. Implement with a library like rank_bm25 or ElasticSearch.
+    Tokenize a corpus once and build its BM25 index. A cached index is only
+    reused if it was built from the same corpus; otherwise it is rebuilt.
+    Args:
+        corpus: List of dicts (chunks) with a "text" field.
+        cache_path: Optional pickle file to load the index from, or save it to.
+    Returns:
+        BM25Okapi index over the corpus
+    """
+    fingerprint = corpus_fingerprint(corpus) if cache_path else None
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path, 'rb') as f:
+            cached = pickle.load(f)
+        if isinstance(cached, dict) and cached.get("fingerprint") == fingerprint:
+            return cached["bm25"]
+    
+    bm25 = BM25Okapi([tokenize_for_bm25(chunk.get("text", "")) for chunk in corpus])
+    if cache_path:
+        with open(cache_path, 'wb') as f:
+            pickle.dump({"fingerprint": fingerprint, "bm25": bm25}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return bm25
+
+def bm25_search(query: str, corpus: list, top_k: int = 5, bm25: BM25Okapi = None):
+    """
+    Keyword search over a corpus with BM25. The corpus is only tokenized
+    the first time it is searched; later queries reuse its index until
+    chunks are added, removed or their text changes.
     Args:
         query: User's question.
         corpus: List of dicts (chunks) to search over.
         top_k: Number of results to return.
+        bm25: Optional prebuilt index for corpus (see build_bm25_index).
     Returns:
         List of dicts (same format as vector search)
     """
-    # TODO: Implement BM25 search
-    return []
+    global _bm25_corpus_key, _bm25_index
+    if not corpus:
+        return []
+    if bm25 is None:
+        # Identity of each chunk's text: cheap to compare per query, and
+        # changes whenever a chunk is added, removed or its text replaced
+        corpus_key = tuple(id(chunk.get("text")) for chunk in corpus)
+        if corpus_key != _bm25_corpus_key:
+            _bm25_index = build_bm25_index(corpus)
+            _bm25_corpus_key = corpus_key
+        bm25 = _bm25_index
+    
+    scores = bm25.get_scores(tokenize_for_bm25(query))
+    if len(scores) != len(corpus):
+        raise ValueError(f"BM25 index covers {len(scores)} chunks but corpus has {len(corpus)}")
+    top = heapq.nlargest(top_k, range(len(corpus)), key=scores.__getitem__)
+    return [{**corpus[i], "score": float(scores[i])} for i in top]
 
 # --- Cross-Encoder Reranking (Stub) ---
 def cross_encoder_rerank(query: str, candidates: list, model_name: str = None, top_k: int = 5):
@@ -166,31 +347,111 @@ def cross_encoder_rerank(query: str, candidates: list, model_name: str = None, t
     # TODO: Implement cross-encoder reranking
     return candidates[:top_k]
 
+# JSON shape Gemini is constrained to in rag_answer
+RAG_ANSWER_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "answer": {"type": "STRING"},
+        "sources": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "company": {"type": "STRING"},
+                    "filing": {"type": "STRING"},
+                    "period": {"type": "STRING"},
+                    "snippet": {"type": "STRING"},
+                    "url": {"type": "STRING"},
+                },
+            },
+        },
+        "confidence": {"type": "NUMBER"},
+    },
+    "required": ["answer", "sources", "confidence"],
+}
+
+class AnswerCache:
+    """
+    LRU cache of rag_answer results keyed by the normalized query text. Only
+    exact repeats hit: near-identical financial questions often differ in
+    just the company, year or quarter, and must not share answers.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        """Initialize an empty cache"""
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(query: str) -> str:
+        """Normalize a query for exact matching"""
+        return " ".join(query.lower().split())
+
+    def get(self, key: str):
+        """Return the answer cached for this key, or None"""
+        with self._lock:
+            answer = self._entries.get(key)
+            if answer is not None:
+                self._entries.move_to_end(key)
+            return answer
+
+    def set(self, key: str, answer: dict):
+        """Store an answer, evicting the least recently used"""
+        with self._lock:
+            self._entries[key] = answer
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+# Answer caches, one per (index_name, top_k, model_name)
+_rag_answer_caches = {}
+
 def rag_answer(user_query, index_name="mag7-financial-intelligence-2025", top_k=5, model_name="models/gemini-1.5-flash-latest", chat_history=None):
+    """
+    Answer a question from retrieved filings. Standalone questions asked
+    before are served from the answer cache; follow-ups that depend on chat
+    history always run.
+    """
+    if chat_history:
+        return _generate_rag_answer(user_query, index_name, top_k, model_name, chat_history)
+    
+    cache = _rag_answer_caches.setdefault((index_name, top_k, model_name), AnswerCache())
+    key = cache.make_key(user_query)
+    answer = cache.get(key)
+    if answer is not None:
+        return answer
+    
+    answer = _generate_rag_answer(user_query, index_name, top_k, model_name, chat_history)
+    if "error" not in answer:
+        cache.set(key, answer)
+    return answer
+
+def _generate_rag_answer(user_query, index_name, top_k, model_name, chat_history):
     # 1. Retrieve using integrated embeddings
     results = query_pinecone(user_query, index_name, top_k=top_k)
     
     # 2. Build context and citations
-    context = ""
+    context_parts = []
     citations = []
-    for i, r in enumerate(results):
-        context += f"[{i+1}] {r['text']}\n"
+    for i, r in enumerate(results, 1):
+        text = r["text"]
+        context_parts.append(f"[{i}] {text}\n")
         citations.append({
             "company": r["company"],
             "filing": r["form_type"],
             "period": r["filing_date"],
-            "snippet": r["text"][:120] + ("..." if len(r["text"]) > 120 else ""),
+            "snippet": f"{text[:120]}..." if len(text) > 120 else text,
             "url": build_sec_url(r["company"], r.get("accession_number"), r.get("source_file"))
         })
     
     # 3. Compose prompt with chat history
-    prompt = ""
-    if chat_history:
-        for turn in chat_history:
-            prompt += f"{turn['role'].capitalize()}: {turn['content']}\n"
-    prompt += (
+    history = "".join(
+        f"{turn['role'].capitalize()}: {turn['content']}\n" for turn in chat_history or ()
+    )
+    prompt = history + (
         f"User: {user_query}\n"
-        f"Context:\n{context}\n"
+        f"Context:\n{''.join(context_parts)}\n"
         "Please answer the question using only the provided context. "
         "Return your answer in the following JSON format:\n"
         "{\n"
@@ -201,21 +462,24 @@ def rag_answer(user_query, index_name="mag7-financial-intelligence-2025", top_k=
     )
     
     # 4. Call Gemini
-    genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
-    model = genai.GenerativeModel(model_name)
-    response = model.generate_content(prompt)
+    model = get_generative_model(model_name)
+    response = model.generate_content(
+        prompt,
+        generation_config=genai.GenerationConfig(
+            response_mime_type="application/json",
+            response_schema=RAG_ANSWER_SCHEMA
+        )
+    )
     
-    # 5. Parse and return JSON
+    # 5. Parse and return JSON (JSON mode returns the object as the whole text)
     try:
-        start = response.text.find('{')
-        end = response.text.rfind('}') + 1
-        json_str = response.text[start:end]
-        return json.loads(json_str)
+        return json.loads(response.text)
     except Exception as e:
         logger.error(f"Failed to parse JSON from LLM response: {e}\nRaw response: {response.text}")
         return {"error": "Failed to parse LLM response", "raw": response.text}
 
 if __name__ == "__main__":
+    _log_env_debug()
     query1 = "What was Microsoft's revenue for Q1 2024?"
     answer1 = rag_answer(query1)
     print("First turn:")
@@ -239,7 +503,7 @@ if __name__ == "__main__":
         print(f"{r['company']} {r['form_type']} {r['filing_date']} | Score: {r['score']}")
         print(r['text'][:300], "...\n")
 
-    # Example: Hybrid search (BM25 + vector) and rerank (stubs)
+    # Example: Hybrid search (BM25 + vector) and rerank (stub)
     # corpus = ... # Load all chunks as a list of dicts
     # bm25_results = bm25_search(query, corpus, top_k=10)
     # vector_results = query_pinecone(query, index_name, top_k=10)